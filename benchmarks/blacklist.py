@@ -0,0 +1,42 @@
+"""
+Compares blacklist lookups against the old list with lookups against the dict that `Cache.blacklist` uses now, at
+100k blacklisted ids.
+
+Usage: python benchmarks/blacklist.py [--size 100000] [--lookups 10000]
+"""
+import argparse
+import random
+import timeit
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ids = rng.sample(range(10 ** 17, 10 ** 18), args.size)  # snowflake sized
+    rows = [(user_id, f"reason {i}") for i, user_id in enumerate(ids)]
+    # almost every invocation is from a user that isn't blacklisted, which is the worst case for a list
+    lookups = [rng.choice(ids) if rng.random() < 0.01 else rng.randrange(10 ** 17, 10 ** 18)
+               for _ in range(args.lookups)]
+
+    old = [user_id for user_id, _ in rows]  # load_blacklist before
+    new = {user_id: reason for user_id, reason in rows}  # load_blacklist now
+
+    print(f"{args.size:,} blacklisted ids, {args.lookups:,} lookups (1% hits)")
+    for name, blacklist in (("list", old), ("dict", new)):
+        elapsed = min(timeit.repeat(lambda: [user_id in blacklist for user_id in lookups], number=1, repeat=3))
+        print(f"{name}: {elapsed / args.lookups * 1e6:10.3f}us/lookup")
+
+    for name, op in (("list", lambda: (old.append(1), old.remove(1))),
+                     ("dict", lambda: (new.__setitem__(1, "x"), new.pop(1)))):
+        # remove has to scan the whole list
+        elapsed = min(timeit.repeat(op, number=100, repeat=3)) / 100
+        print(f"{name} add + remove: {elapsed * 1e6:10.3f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compares the old image manipulation, which filtered images at full resolution and always encoded them as png, with
+the current pipeline that downscales to the filter's cap first and picks the encoding by size. Reports the latency
+and output size of each filter over a set of local images.
+
+Usage: python benchmarks/image_pipeline.py IMAGE_OR_DIRECTORY [...] [--filters solarize edges emboss] [--repeat 3]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import polaroid  # noqa: E402
+
+from cogs.ImageManip import PIPELINE_FILTERS, FILTER_MAX_DIMENSIONS, MAX_DIMENSIONS, polaroid_image_manip  # noqa: E402
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp")
+
+
+def old_image_manip(image: bytes, func: str):
+    # the manipulation done before the preprocessing stage
+    image = polaroid.Image(image)
+    getattr(image, func)()
+    return image.save_bytes()
+
+
+def new_image_manip(image: bytes, func: str):
+    return polaroid_image_manip(image, ((func, (), {}),), FILTER_MAX_DIMENSIONS.get(func, MAX_DIMENSIONS))[0]
+
+
+def find_images(paths: list):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                          if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(path)
+    return images
+
+
+def run(manip, images: list, func: str, repeat: int):
+    """
+    Returns the median latency and the mean output size of a manipulation over every image.
+    """
+    latencies = []
+    sizes = []
+    for image in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = manip(image, func)
+            latencies.append(time.perf_counter() - start)
+        sizes.append(len(output))
+    return statistics.median(latencies), statistics.mean(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--filters", nargs="+", default=["solarize", "greyscale", "edges", "emboss", "sepia"],
+                        choices=sorted(PIPELINE_FILTERS))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    images = []
+    for path in find_images(args.paths):
+        with open(path, "rb") as f:
+            images.append(f.read())
+    if not images:
+        parser.error("no images found")
+    print(f"{len(images)} images, {statistics.mean(map(len, images)) / 1024:.0f}KB on average, "
+          f"median of {args.repeat} runs each")
+
+    for name in args.filters:
+        func = PIPELINE_FILTERS[name]
+        old_latency, old_size = run(old_image_manip, images, func, args.repeat)
+        new_latency, new_size = run(new_image_manip, images, func, args.repeat)
+        print(f"{name}:")
+        print(f"  old: {old_latency * 1000:9.1f}ms {old_size / 1024:9.0f}KB")
+        print(f"  new: {new_latency * 1000:9.1f}ms {new_size / 1024:9.0f}KB "
+              f"({old_latency / new_latency:.1f}x faster, {old_size / new_size:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the old OCR, which ran on the default executor at full resolution, with the dedicated OCR process pool
+and its preprocessing. Every image in a local corpus is submitted at once, like a burst of `ocr` commands, and the
+throughput and latency percentiles (including the time spent queueing) are reported. The result cache is bypassed.
+
+Usage: python benchmarks/ocr.py CORPUS_DIRECTORY [--repeat 2] [--options greyscale threshold]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+import pytesseract  # noqa: E402
+
+from concurrent.futures import ProcessPoolExecutor  # noqa: E402
+
+from cogs.Meta import OCR_WORKERS, OCR_OPTIONS, init_ocr_worker, ocr_image  # noqa: E402
+from config import config  # noqa: E402
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".bmp", ".tiff")
+
+
+def old_ocr(image: bytes):
+    # the ocr done before the pool, with frombuffer since fromstring no longer accepts binary data
+    img = cv2.imdecode(np.frombuffer(image, np.uint8), 1)
+    return pytesseract.image_to_string(img)
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def burst(submit, images: list):
+    """
+    Submits every image at once and returns the wall time and the latency of each image.
+    """
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(timed(submit(image)) for image in images))
+    return time.perf_counter() - start, latencies
+
+
+def report(name: str, elapsed: float, latencies: list):
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"{name}: {len(latencies) / elapsed:7.2f} images/s, p50 {percentiles[49]:7.2f}s, "
+          f"p95 {percentiles[94]:7.2f}s, max {max(latencies):7.2f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus")
+    parser.add_argument("--repeat", type=int, default=2, help="times every image is submitted")
+    parser.add_argument("--options", nargs="*", default=[], choices=sorted(OCR_OPTIONS))
+    args = parser.parse_args()
+
+    images = []
+    for name in sorted(os.listdir(args.corpus)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(args.corpus, name), "rb") as f:
+                images.append(f.read())
+    if len(images) * args.repeat < 2:
+        parser.error("the corpus needs at least two images to compute percentiles")
+    images *= args.repeat
+    options = frozenset(OCR_OPTIONS[option] for option in args.options)
+    print(f"{len(images)} ocr requests, {OCR_WORKERS} pool workers, options: {', '.join(sorted(options)) or 'none'}")
+
+    loop = asyncio.get_running_loop()
+    report("old", *await burst(lambda image: loop.run_in_executor(None, old_ocr, image), images))
+
+    with ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=init_ocr_worker,
+                             initargs=(config["tesseract_path"],)) as executor:
+        # start the workers first so that process startup isn't counted
+        await asyncio.gather(*(loop.run_in_executor(executor, time.sleep, 0.1) for _ in range(OCR_WORKERS)))
+        report("new", *await burst(lambda image: loop.run_in_executor(executor, ocr_image, image, options), images))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+Compares the old per-message prefix matching in `get_prefix` with the precompiled `PrefixMatcher`s over a synthetic
+stream of messages.
+
+The old matcher compiles a regex per prefix per message and takes over a millisecond per message, so by default it
+only runs on the first 50,000 messages and its per-message cost is compared.
+
+Usage: python benchmarks/prefix_matcher.py [--messages 1000000] [--old-messages 50000] [--guilds 1000]
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.utils import PrefixMatcher  # noqa: E402
+
+PREFIX_CHARS = string.ascii_lowercase + "!>;"  # no regex metacharacters, the old matcher didn't escape prefixes
+WORDS = ["hello", "lol", "anyone", "here", "what", "is", "the", "best", "song", "ok", "thanks", "gg", "brb"]
+
+
+def old_match(prefixes: list, content: str):
+    # the matching done by get_prefix before the prefix matchers
+    prefixes = sorted(prefixes, key=len)
+    for prefix in prefixes:
+        match = re.match(rf"^({prefix}\s*).*", content, flags=re.IGNORECASE)
+        if match:
+            return match.group(1)
+
+
+def make_guilds(rng: random.Random, count: int):
+    return [["".join(rng.choices(PREFIX_CHARS, k=rng.randint(1, 5))) for _ in range(rng.randint(1, 50))]
+            for _ in range(count)]
+
+
+def make_messages(rng: random.Random, guilds: list, count: int, command_ratio: float):
+    messages = []
+    for _ in range(count):
+        guild = rng.randrange(len(guilds))
+        if rng.random() < command_ratio:
+            content = f"{rng.choice(guilds[guild])}{rng.choice(['', ' '])}help"
+        else:
+            content = " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+        messages.append((guild, content))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--old-messages", type=int, default=50_000)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--command-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    guilds = make_guilds(rng, args.guilds)
+    messages = make_messages(rng, guilds, args.messages, args.command_ratio)
+    print(f"{args.messages:,} messages across {args.guilds:,} guilds "
+          f"({sum(map(len, guilds)) / len(guilds):.1f} prefixes per guild on average)")
+
+    old_messages = messages[:args.old_messages]
+    start = time.perf_counter()
+    old_results = [old_match(guilds[guild], content) for guild, content in old_messages]
+    old_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matchers = [PrefixMatcher(prefixes) for prefixes in guilds]  # built once per guild, like Cache.prefix_matchers
+    build_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_results = [matchers[guild].match(content) if matchers[guild].could_match(content) else None
+                   for guild, content in messages]
+    new_elapsed = time.perf_counter() - start
+
+    mismatches = sum(old != new for old, new in zip(old_results, new_results))
+    old_per_message = old_elapsed / len(old_messages)
+    new_per_message = new_elapsed / len(messages)
+    print(f"old:  {old_elapsed:8.3f}s  {old_per_message * 1e6:9.3f}us/message ({len(old_messages):,} messages)")
+    print(f"new:  {new_elapsed:8.3f}s  {new_per_message * 1e6:9.3f}us/message ({len(messages):,} messages, "
+          f"+{build_elapsed:.3f}s to build the matchers)")
+    print(f"speedup: {old_per_message / new_per_message:.1f}x, "
+          f"mismatched results: {mismatches:,} of {len(old_results):,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Measures the gap between a song ending and the next one being sent to the node, for the old `do_next` that updated
+the now playing message before playing and the current one that plays first and announces in the background.
+The node and Discord are stubs that sleep for a simulated round trip.
+
+Usage: python benchmarks/song_gap.py [--songs 50] [--rest-latency 0.15] [--jitter 0.1] [--node-latency 0.005]
+       [--song-length 0.5]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord  # noqa: E402
+
+from contextlib import suppress  # noqa: E402
+
+from cogs.Music import Player, SongQueue  # noqa: E402
+
+
+class StubTrack:
+    def __init__(self, title: str):
+        self.title = title
+        self.requester = "benchmark"
+
+    def __str__(self):
+        return self.title
+
+
+class StubDiscord:
+    """
+    A channel and its messages, every REST call takes `rest_latency` plus up to `jitter` seconds.
+    """
+    def __init__(self, rng: random.Random, rest_latency: float, jitter: float):
+        self.rng = rng
+        self.rest_latency = rest_latency
+        self.jitter = jitter
+
+    async def round_trip(self):
+        await asyncio.sleep(self.rest_latency + self.rng.uniform(0, self.jitter))
+
+    async def send(self, *, embed: discord.Embed):
+        await self.round_trip()
+        return self
+
+    async def delete(self):
+        await self.round_trip()
+
+
+class StubPlayer:
+    """
+    Just enough of a player for `Player.do_next` and `Player.announce`, with a node that receives the play after
+    `node_latency` seconds.
+    """
+    announce = Player.announce
+    do_next = Player.do_next
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, channel: StubDiscord, node_latency: float, songs: int):
+        self.bot = types.SimpleNamespace(loop=loop, embed_colour=discord.Colour.blurple())
+        self.session_chan = channel
+        self.now_playing = None
+        self.node_latency = node_latency
+        self.queue = SongQueue()
+        self.queue.extend([StubTrack(f"song {i}") for i in range(songs)])
+        self.announcements = []
+        self.announce_lock = asyncio.Lock()
+        self.dirty = False
+        self.played_at = None
+
+    async def play(self, song: StubTrack):
+        await asyncio.sleep(self.node_latency)
+        self.played_at = time.perf_counter()
+
+    async def destroy(self):
+        pass
+
+    async def old_do_next(self):
+        # do_next before the announcements were moved to the background
+        with suppress((discord.Forbidden, discord.HTTPException, AttributeError)):
+            await self.now_playing.delete()
+
+        if (song := self.queue.advance()) is None:
+            await self.destroy()
+            return
+        self.dirty = True
+
+        embed = discord.Embed(title="Now Playing:", description=f"{song}", colour=self.bot.embed_colour)
+        embed.set_footer(text=f"Requested by {song.requester}")
+        self.now_playing = await self.session_chan.send(embed=embed)
+        await self.play(song)
+
+
+async def measure(player: StubPlayer, do_next, songs: int, song_length: float):
+    gaps = []
+    for _ in range(songs):
+        ended_at = time.perf_counter()  # TrackEnd
+        await do_next()
+        gaps.append(player.played_at - ended_at)
+        await asyncio.sleep(song_length)  # the song plays, letting the announcement finish
+    await asyncio.gather(*player.announcements)
+    return gaps
+
+
+def report(name: str, gaps: list):
+    percentiles = statistics.quantiles(gaps, n=100)
+    print(f"{name}: mean {statistics.mean(gaps) * 1000:7.1f}ms, p50 {percentiles[49] * 1000:7.1f}ms, "
+          f"p95 {percentiles[94] * 1000:7.1f}ms, max {max(gaps) * 1000:7.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs", type=int, default=50)
+    parser.add_argument("--rest-latency", type=float, default=0.15, help="seconds per Discord REST call")
+    parser.add_argument("--jitter", type=float, default=0.1, help="max extra seconds per Discord REST call")
+    parser.add_argument("--node-latency", type=float, default=0.005, help="seconds for the play to reach the node")
+    parser.add_argument("--song-length", type=float, default=0.5, help="seconds between song changes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    loop = asyncio.get_running_loop()
+    print(f"{args.songs} song changes, {args.rest_latency * 1000:g}ms (+{args.jitter * 1000:g}ms) per REST call, "
+          f"{args.node_latency * 1000:g}ms to the node")
+    for name in ("old", "new"):
+        channel = StubDiscord(random.Random(args.seed), args.rest_latency, args.jitter)
+        player = StubPlayer(loop, channel, args.node_latency, args.songs)
+        do_next = player.old_do_next if name == "old" else player.do_next
+        report(name, await measure(player, do_next, args.songs, args.song_length))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from config import config
+
+# constants
+
+IDENTIFY_DELAY = 5  # seconds between each shard identifying
+RESTART_DELAY = 10
+
+log = logging.getLogger(__name__)
+
+
+def shard_ranges(shard_count: int, workers: int):
+    """
+    Splits the shards into contiguous ranges, one per worker.
+    """
+    workers = min(workers, shard_count)
+    size, extra = divmod(shard_count, workers)
+    ranges, start = [], 0
+    for worker in range(workers):
+        end = start + size + (worker < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def run_worker(shard_ids: list, shard_count: int, delay: float):
+    # every worker shares the same identify ratelimit, so stagger them
+    time.sleep(delay)
+
+    from utils.classes import PB_Bot
+
+    bot = PB_Bot(shard_ids=shard_ids, shard_count=shard_count)
+    bot.run(config["token"])
+
+
+class Cluster:
+    """
+    Spawns one bot process per shard range and restarts any that die.
+    """
+    def __init__(self, shard_count: int, workers: int):
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, workers)
+        self.processes = {}
+        self.context = multiprocessing.get_context("spawn")
+        self.running = True
+
+    def spawn(self, worker: int, delay: float = 0):
+        process = self.context.Process(
+            target=run_worker, args=(self.ranges[worker], self.shard_count, delay), name=f"PB Bot Worker {worker}")
+        process.start()
+        self.processes[worker] = process
+        log.info("Started worker %s (PID %s) with shards %s", worker, process.pid, self.ranges[worker])
+
+    def stop(self, *_):
+        self.running = False
+        for process in self.processes.values():
+            process.terminate()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        delay = 0
+        for worker, shard_ids in enumerate(self.ranges):
+            self.spawn(worker, delay)
+            delay += len(shard_ids) * IDENTIFY_DELAY
+
+        while self.running:
+            time.sleep(1)
+            for worker, process in list(self.processes.items()):
+                if not process.is_alive() and self.running:
+                    log.warning("Worker %s exited with code %s, restarting...", worker, process.exitcode)
+                    self.spawn(worker, RESTART_DELAY)
+
+        for process in self.processes.values():
+            process.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    cluster_config = config.get("cluster", {})
+    Cluster(
+        shard_count=cluster_config.get("shard_count", config.get("shard_count", 1)),
+        workers=cluster_config.get("workers", os.cpu_count() or 1)
+    ).run()
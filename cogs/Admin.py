@@ -4,8 +4,12 @@ import re
 import subprocess
 import typing
 import io
+import time
+import asyncio
 
-from discord.ext import commands, menus
+from discord.ext import commands, menus, tasks
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from selenium import webdriver
 from selenium.common.exceptions import InvalidArgumentException, WebDriverException
 from selenium.webdriver.chrome.options import Options
@@ -17,15 +21,147 @@ from config import config
 # constants
 
 SUPPORT_SERVER_ID = 798329404325101600
+SCREENSHOT_WORKERS = 2
+SCREENSHOT_TIMEOUT = 30  # seconds
+SCREENSHOT_PAGE_LIMIT = 50  # pages before a browser is restarted
+SCREENSHOT_IDLE_TIMEOUT = 5 * 60  # seconds before an unused browser is closed
+SCREENSHOT_CACHE_TTL = 60
+SCREENSHOT_CACHE_BYTES = 32 * 1024 * 1024  # full page pngs can be several megabytes each
 options = Options()
 options.add_argument("--headless")
-driver = webdriver.Chrome(config["webdriver_path"], chrome_options=options)
+
+
+class Browser:
+    """
+    A headless browser that is only started when it's first needed.
+    """
+    def __init__(self):
+        self.driver = None
+        self.pages = 0
+        self.busy = False
+        self.retired = False
+        self.last_used = time.monotonic()
+
+    def screenshot(self, url: str):
+        # runs in an executor
+        if self.retired:  # the request timed out before the executor got to it
+            raise WebDriverException("This browser was retired.")
+        if self.driver is None:
+            driver = webdriver.Chrome(config["webdriver_path"], chrome_options=options)
+            if self.retired:  # the request timed out while the driver was starting
+                driver.quit()
+                raise WebDriverException("This browser was retired.")
+            self.driver = driver
+        driver = self.driver
+        self.pages += 1
+        driver.get(url)
+        return driver.get_screenshot_as_png()
+
+    def detach(self):
+        """
+        Detaches the current driver so that it can be quit without racing a new one.
+        """
+        driver, self.driver = self.driver, None
+        self.pages = 0
+        return driver
+
+
+class ScreenshotService:
+    """
+    Takes screenshots with a bounded pool of browsers. Requests wait in a queue for a free browser, browsers are
+    recycled after `SCREENSHOT_PAGE_LIMIT` pages or when they're idle and results are cached for a short time.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, *, workers: int = SCREENSHOT_WORKERS):
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="screenshot")
+        self.browsers = [Browser() for _ in range(workers)]
+        self.idle = asyncio.Queue()
+        for browser in self.browsers:
+            self.idle.put_nowait(browser)
+        self.cache = utils.LRUCache(100, ttl=SCREENSHOT_CACHE_TTL, maxbytes=SCREENSHOT_CACHE_BYTES)
+        self.waiting = 0
+
+    def quit(self, browser: Browser):
+        if (driver := browser.detach()) is not None:
+            self.loop.run_in_executor(None, driver.quit)
+
+    def replace(self, browser: Browser):
+        """
+        Retires a browser whose executor thread may still be using it and returns a new one to take its place.
+        """
+        browser.retired = True
+        self.quit(browser)  # this also makes the stuck page load fail, freeing the thread
+        new_browser = Browser()
+        self.browsers[self.browsers.index(browser)] = new_browser
+        return new_browser
+
+    async def screenshot(self, url: str):
+        if (png := self.cache.get(url)) is not None:
+            return png
+
+        self.waiting += 1
+        try:
+            browser = await asyncio.wait_for(self.idle.get(), timeout=SCREENSHOT_TIMEOUT)
+        finally:
+            self.waiting -= 1
+        browser.busy = True
+
+        try:
+            png = await asyncio.wait_for(
+                self.loop.run_in_executor(self.executor, browser.screenshot, url), timeout=SCREENSHOT_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # the page is stuck or the request was cancelled, either way its thread may still hold the browser, so a
+            # new one goes back to the idle queue
+            browser = self.replace(browser)
+            raise
+        finally:
+            browser.last_used = time.monotonic()
+            if browser.pages >= SCREENSHOT_PAGE_LIMIT:
+                self.quit(browser)
+            browser.busy = False
+            self.idle.put_nowait(browser)
+
+        self.cache[url] = png
+        return png
+
+    def close_idle(self):
+        now = time.monotonic()
+        for browser in self.browsers:
+            if not browser.busy and now - browser.last_used > SCREENSHOT_IDLE_TIMEOUT:
+                self.quit(browser)
+
+    def close(self):
+        for browser in self.browsers:
+            if (driver := browser.detach()) is not None:
+                with suppress(WebDriverException):
+                    driver.quit()
+        self.executor.shutdown(wait=False)
+
+    @property
+    def stats(self):
+        return {"browsers running": sum(browser.driver is not None for browser in self.browsers),
+                "waiting requests": self.waiting, **self.cache.stats}
 
 
 class Admin(commands.Cog):
     """
     Commands that only my owner can use.
     """
+    def __init__(self, bot):
+        self.bot = bot
+        self.screenshots = ScreenshotService(bot.loop)
+        bot.metric_sources["Screenshots"] = lambda: self.screenshots.stats
+        self.close_idle_browsers.start()
+
+    def cog_unload(self):
+        self.close_idle_browsers.cancel()
+        self.bot.metric_sources.pop("Screenshots", None)
+        self.screenshots.close()
+
+    @tasks.loop(minutes=1)
+    async def close_idle_browsers(self):
+        self.screenshots.close_idle()
+
     async def cog_check(self, ctx: CustomContext):
         if not await ctx.bot.is_owner(ctx.author):
             raise commands.NotOwner
@@ -260,7 +396,7 @@ class Admin(commands.Cog):
         """
         Display all blacklisted users.
         """
-        data = list(dict(await ctx.bot.pool.fetch("SELECT * FROM blacklisted_users")).items())
+        data = list(ctx.bot.cache.blacklist.items())
         await menus.MenuPages(utils.BlacklistSource(data, per_page=10), delete_message_after=True).start(ctx)
 
     @blacklist.command()
@@ -322,6 +458,51 @@ class Admin(commands.Cog):
 
         await ctx.send(embed=embed)
 
+    @admin.command()
+    async def metrics(self, ctx: CustomContext):
+        """
+        Displays internal performance counters.
+        """
+        embed = discord.Embed(title="Metrics", colour=ctx.bot.embed_colour, timestamp=datetime.datetime.now())
+        for name, source in ctx.bot.metric_sources.items():
+            data = {str(k): f"{v:,.3f}" if isinstance(v, float) else f"{v:,}" if isinstance(v, int) else str(v)
+                    for k, v in source().items()}
+            value = utils.padding(data, separator=" - ") if data else "Nothing recorded yet."
+            embed.add_field(name=name, value=f"```py\n{value}```", inline=False)
+        await ctx.send(embed=embed)
+
+    @admin.command()
+    async def http(self, ctx: CustomContext, host: str = None):
+        """
+        Displays the latency histogram and errors for each host (or one host) the bot has made requests to.
+
+        `host` - The host to show. Defaults to all of them.
+        """
+        client = ctx.bot.http_client
+        hosts = [host] if host is not None else sorted(client.latencies, key=lambda h: sum(client.latencies[h]),
+                                                       reverse=True)
+        if not hosts or host is not None and host not in client.latencies:
+            return await ctx.send("No requests recorded yet.")
+        embed = discord.Embed(title="HTTP Hosts", colour=ctx.bot.embed_colour, timestamp=datetime.datetime.now())
+        for host in hosts[:10]:  # embeds are limited to 6000 characters
+            data = {**client.histogram(host), **{f"error {k}": v for k, v in client.errors[host].items()}}
+            embed.add_field(name=host, value=f"```py\n{utils.padding(data, separator=' - ')}```", inline=False)
+        await ctx.send(embed=embed)
+
+    @admin.command(aliases=["imports"])
+    async def importtimes(self, ctx: CustomContext):
+        """
+        Displays how long each cog and its dependencies took to import.
+        """
+        lines = []
+        import_times = sorted(ctx.bot.import_times.items(), key=lambda item: item[1]["total"], reverse=True)
+        for cog, data in import_times:
+            lines.append(f"{cog}: {data['total'] * 1000:.2f}ms")
+            lines.extend(f"    {module}: {elapsed * 1000:.2f}ms" for module, elapsed in data["dependencies"].items())
+        lines.extend(f"{cog}: not loaded yet" for cog in ctx.bot.lazy_extensions)
+        await menus.MenuPages(utils.PaginatorSource(["\n".join(lines[i:i + 20]) for i in range(0, len(lines), 20)]),
+                              delete_message_after=True).start(ctx)
+
     @admin.command(aliases=["ss"])
     async def screenshot(self, ctx: CustomContext, url: str):
         """
@@ -332,12 +513,14 @@ class Admin(commands.Cog):
         async with ctx.typing():
             with utils.StopWatch() as sw:
                 try:
-                    await ctx.bot.loop.run_in_executor(None, driver.get, url)
+                    png = await self.screenshots.screenshot(url)
                 except InvalidArgumentException:
                     return await ctx.send("Invalid url provided (did you forget the `http://` or `https://`?).")
                 except WebDriverException:
                     return await ctx.send("Couldn't screenshot that webpage.")
-            b = io.BytesIO(driver.get_screenshot_as_png())
+                except asyncio.TimeoutError:
+                    return await ctx.send("Screenshotting that webpage took too long.")
+            b = io.BytesIO(png)
             file = discord.File(b, filename="screenshot.png")
             embed = discord.Embed(colour=ctx.bot.embed_colour, timestamp=datetime.datetime.now())
             embed.set_image(url="attachment://screenshot.png")
@@ -346,4 +529,4 @@ class Admin(commands.Cog):
 
 
 def setup(bot):
-    bot.add_cog(Admin())
+    bot.add_cog(Admin(bot))
@@ -15,6 +15,7 @@ from utils.classes import CustomContext, PB_Bot
 
 PREFIX_LENGTH_LIMIT = 10
 TOTAL_PREFIX_LIMIT = 50
+STATS_DAY_LIMIT = 365
 
 
 def top5(items: list):
@@ -43,12 +44,29 @@ class BotInfo(commands.Cog, name="Bot Info"):
                          10: "HELLO",
                          11: "HEARTBEAT_ACK"}
 
+    def get_shard_id(self, message):
+        """
+        Works out which shard received a dispatch from the guild it belongs to. Returns `None` if it has no guild.
+        """
+        data = message.get("d")
+        if message["op"] != 0 or not isinstance(data, dict):
+            return None
+        guild_id = data.get("guild_id")
+        if guild_id is None and message["t"] in ("GUILD_CREATE", "GUILD_UPDATE", "GUILD_DELETE"):
+            guild_id = data.get("id")
+        if guild_id is None:
+            return None
+        return (int(guild_id) >> 22) % (self.bot.shard_count or 1)
+
     @commands.Cog.listener()
     async def on_socket_response(self, message):
         if message["op"] == 0:
-            return self.bot.cache.socketstats.update([message["t"]])
-        msg = self.op_codes.get(message["op"], "NONE")
+            msg = message["t"]
+        else:
+            msg = self.op_codes.get(message["op"], "NONE")
         self.bot.cache.socketstats.update([msg])
+        if (shard_id := self.get_shard_id(message)) is not None:
+            self.bot.cache.shard_socketstats[shard_id].update([msg])
 
     @commands.command(aliases=["up"])
     async def uptime(self, ctx: CustomContext):
@@ -91,6 +109,11 @@ class BotInfo(commands.Cog, name="Bot Info"):
             embed.add_field(name="\u200b", value="\u200b")
             embed.add_field(name="Round-Trip Time", value=f"```py\n{rtt_str}```")
 
+        if len(ctx.bot.latencies) > 1:
+            shard_latencies = "\n".join(f"Shard {shard_id}: {latency * 1000:.{decimal_places}f}ms"
+                                        for shard_id, latency in ctx.bot.latencies)
+            embed.add_field(name="Shard Latencies", value=f"```py\n{shard_latencies}```", inline=False)
+
         await ctx.send(embed=embed)
 
     @commands.command()
@@ -101,13 +124,16 @@ class BotInfo(commands.Cog, name="Bot Info"):
         v = sys.version_info
         p = psutil.Process()
         m = p.memory_full_info()
-        top5commands_today = ctx.bot.cache.command_stats["top_commands_today"].most_common(5)
+        top5commands_today = (await ctx.bot.cache.get_cmd_stats("top_commands_today")).most_common(5)
         uptime = datetime.datetime.now() - ctx.bot.start_time
         recent_commits = await ctx.bot.get_recent_commits()
         latencies = {k: f"{v * 1000:.2f}ms" for k, v in zip(
             ["Websocket Latency", "API Response Time", "Database Ping (postgresql)", "Database Ping (redis)"],
             [ctx.bot.latency, await ctx.bot.api_ping(ctx), await ctx.bot.postgresql_ping(), await ctx.bot.redis_ping()]
         )}
+        if len(ctx.bot.latencies) > 1:
+            latencies.update({f"Shard {shard_id} Latency": f"{latency * 1000:.2f}ms"
+                              for shard_id, latency in ctx.bot.latencies})
 
         embed = discord.Embed(title="Bot Info", colour=ctx.bot.embed_colour)
         embed.set_thumbnail(url=ctx.bot.user.avatar_url)
@@ -117,7 +143,8 @@ class BotInfo(commands.Cog, name="Bot Info"):
             name="General",
             value=
             f"• Running discord.py version **{discord.__version__}** on python **{v.major}.{v.minor}.{v.micro}**\n"
-            f"• This bot is not sharded and can see **{len(ctx.bot.guilds)}** servers and **{len(ctx.bot.users)}** users\n"
+            f"• This bot has **{ctx.bot.shard_count}** shard{'' if ctx.bot.shard_count == 1 else 's'} and can see "
+            f"**{len(ctx.bot.guilds)}** servers and **{len(ctx.bot.users)}** users\n"
             f"• **{len(ctx.bot.cogs)}** cogs loaded and **{len(ctx.bot.commands)}** commands loaded\n"
             f"• **Uptime since last restart:** {humanize.precisedelta(uptime)}", inline=False)
 
@@ -248,11 +275,14 @@ class BotInfo(commands.Cog, name="Bot Info"):
         if isinstance(command, commands.HelpCommand):
             lines, starting_line_num = inspect.getsourcelines(type(command))
             filepath = f"{command.__module__.replace('.', '/')}.py"
+            ending_line_num = starting_line_num + len(lines) - 1
+        elif command.qualified_name in ctx.bot.lazy_sources:  # a stub for a cog that hasn't been loaded yet
+            filepath, starting_line_num, ending_line_num = ctx.bot.lazy_sources[command.qualified_name]
         else:
             lines, starting_line_num = inspect.getsourcelines(command.callback.__code__)
             filepath = f"{command.callback.__module__.replace('.', '/')}.py"
+            ending_line_num = starting_line_num + len(lines) - 1
 
-        ending_line_num = starting_line_num + len(lines) - 1
         command = "help" if isinstance(command, commands.HelpCommand) else command
         embed = discord.Embed(
             title=f"Here is my source code for the `{command}` command.",
@@ -261,17 +291,18 @@ class BotInfo(commands.Cog, name="Bot Info"):
             colour=ctx.bot.embed_colour)
         await ctx.send(embed=embed)
 
-    @commands.command()
+    @commands.group(invoke_without_command=True)
     async def stats(self, ctx: CustomContext):
         """
         Displays the command usage stats.
         """
-        top5commands_today = ctx.bot.cache.command_stats["top_commands_today"].most_common(5)
-        top5commands_overall = ctx.bot.cache.command_stats["top_commands_overall"].most_common(5)
+        cache = ctx.bot.cache
+        top5commands_today = (await cache.get_cmd_stats("top_commands_today")).most_common(5)
+        top5commands_overall = (await cache.get_cmd_stats("top_commands_overall")).most_common(5)
         top5users_today = [(f"<@!{user_id}>", counter)
-                           for user_id, counter in ctx.bot.cache.command_stats["top_users_today"].most_common(5)]
+                           for user_id, counter in (await cache.get_cmd_stats("top_users_today")).most_common(5)]
         top5users_overall = [(f"<@!{user_id}>", counter)
-                             for user_id, counter in ctx.bot.cache.command_stats["top_users_overall"].most_common(5)]
+                             for user_id, counter in (await cache.get_cmd_stats("top_users_overall")).most_common(5)]
 
         embed = discord.Embed(title="Command Stats", colour=ctx.bot.embed_colour)
         embed.add_field(name="Top 5 Commands Today", value=top5(top5commands_today) or "No commands have been used today.")
@@ -283,6 +314,52 @@ class BotInfo(commands.Cog, name="Bot Info"):
 
         await ctx.send(embed=embed)
 
+    @stats.command(name="commands")
+    async def stats_commands(self, ctx: CustomContext, days: int = 7):
+        """
+        Displays the most used commands over the last few days.
+
+        `days` - The amount of days to look back. Defaults to 7.
+        """
+        days = max(min(days, STATS_DAY_LIMIT), 1)
+        since = datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)  # today counts as a day
+        with utils.StopWatch() as sw:
+            top5commands = await ctx.bot.pool.fetch(
+                "SELECT command, SUM(uses) AS uses FROM command_usage_daily WHERE day >= $1 "
+                "GROUP BY command ORDER BY uses DESC LIMIT 5", since)
+
+        embed = discord.Embed(title=f"Command Stats for the Last {days} Day{'' if days == 1 else 's'}",
+                              colour=ctx.bot.embed_colour)
+        embed.add_field(name="Top 5 Commands", value=top5(top5commands) or "No commands have been used.")
+        embed.set_footer(text=f"Queried in {sw.elapsed * 1000:.2f}ms")
+        await ctx.send(embed=embed)
+
+    @commands.guild_only()
+    @stats.command(name="server", aliases=["guild"])
+    async def stats_server(self, ctx: CustomContext, days: int = 7):
+        """
+        Displays the command usage stats for the current server over the last few days.
+
+        `days` - The amount of days to look back. Defaults to 7.
+        """
+        days = max(min(days, STATS_DAY_LIMIT), 1)
+        since = datetime.datetime.utcnow().date() - datetime.timedelta(days=days - 1)  # today counts as a day
+        with utils.StopWatch() as sw:
+            top5commands = await ctx.bot.pool.fetch(
+                "SELECT command, SUM(uses) AS uses FROM guild_command_usage_daily WHERE guild_id = $1 AND day >= $2 "
+                "GROUP BY command ORDER BY uses DESC LIMIT 5", ctx.guild.id, since)
+            top5users = await ctx.bot.pool.fetch(
+                "SELECT user_id, SUM(uses) AS uses FROM guild_user_usage_daily WHERE guild_id = $1 AND day >= $2 "
+                "GROUP BY user_id ORDER BY uses DESC LIMIT 5", ctx.guild.id, since)
+        top5users = [(f"<@!{user_id}>", uses) for user_id, uses in top5users]
+
+        embed = discord.Embed(title=f"Command Stats for `{ctx.guild}` in the Last {days} Day{'' if days == 1 else 's'}",
+                              colour=ctx.bot.embed_colour)
+        embed.add_field(name="Top 5 Commands", value=top5(top5commands) or "No commands have been used.")
+        embed.add_field(name="Top 5 Users", value=top5(top5users) or "No one has used any commands.")
+        embed.set_footer(text=f"Queried in {sw.elapsed * 1000:.2f}ms")
+        await ctx.send(embed=embed)
+
     @commands.command()
     async def support(self, ctx: CustomContext):
         """
@@ -301,12 +378,20 @@ class BotInfo(commands.Cog, name="Bot Info"):
         await ctx.send(embed=embed)
 
     @commands.command()
-    async def socketstats(self, ctx: CustomContext):
+    async def socketstats(self, ctx: CustomContext, shard_id: int = None):
         """
         Displays the socketstats.
+
+        `shard_id` - Only display the socketstats for this shard (optional). Only events that belong to a server are counted per shard.
         """
+        if shard_id is None:
+            socketstats = ctx.bot.cache.socketstats
+        elif shard_id not in ctx.bot.shards:
+            return await ctx.send(f"Couldn't find a shard with the id `{shard_id}`.")
+        else:
+            socketstats = ctx.bot.cache.shard_socketstats[shard_id]
         menu = menus.MenuPages(
-            utils.SocketStatsSource(ctx.bot.cache.socketstats.most_common()),
+            utils.SocketStatsSource(socketstats.most_common()),
             clear_reactions_after=True
         )
         await menu.start(ctx)
@@ -10,6 +10,8 @@ from discord.ext import commands
 from utils import utils
 from utils.classes import CustomContext
 
+REDDIT_TTL = 60
+
 
 class Fun(commands.Cog):
     """
@@ -32,9 +34,8 @@ class Fun(commands.Cog):
 
         `subreddit` - The subreddit.
         """
-        async with ctx.bot.session.get(f"https://www.reddit.com/r/{subreddit}/new.json") as resp:
-            r = await resp.json()
-        if r.get("error", None) is not None:
+        _, r = await ctx.bot.http_cache.get_json(f"https://www.reddit.com/r/{subreddit}/new.json", ttl=REDDIT_TTL)
+        if r is None or r.get("error", None) is not None:
             return await ctx.send("Couldn't find a subreddit with that name.")
 
         posts = r["data"]["children"]
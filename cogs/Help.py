@@ -5,7 +5,7 @@ from discord.ext import commands
 from contextlib import suppress
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, LazyCog
 
 # constants
 
@@ -35,8 +35,9 @@ class CustomHelpCommand(commands.HelpCommand):
         embed.add_field(name="Category:", value=f"{command.cog_name}", inline=False)
 
         try:
-            can_run = await command.can_run(self.context)
-            if can_run:
+            if isinstance(command.cog, LazyCog):  # the stub doesn't have the real command's checks
+                can_run = "Unknown until first used"
+            elif await command.can_run(self.context):
                 can_run = self.context.bot.emoji_dict["green_tick"]
             else:
                 can_run = self.context.bot.emoji_dict["red_tick"]
@@ -73,8 +74,9 @@ class CustomHelpCommand(commands.HelpCommand):
         embed.add_field(name="Category:", value=f"{group.cog_name}", inline=False)
 
         try:
-            can_run = await group.can_run(self.context)
-            if can_run:
+            if isinstance(group.cog, LazyCog):  # the stub doesn't have the real command's checks
+                can_run = "Unknown until first used"
+            elif await group.can_run(self.context):
                 can_run = self.context.bot.emoji_dict["green_tick"]
             else:
                 can_run = self.context.bot.emoji_dict["red_tick"]
@@ -1,12 +1,122 @@
 import discord
 import polaroid
 import typing
+import os
+import hashlib
+import tempfile
 
 from discord.ext import commands
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import suppress
 from io import BytesIO
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, PB_Bot
+from config import config
+
+# constants
+
+IMAGE_WORKERS = max((os.cpu_count() or 2) - 1, 1)
+IMAGE_QUEUE_LIMIT = IMAGE_WORKERS * 4  # jobs that can be waiting or running before new ones are rejected
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+RANDOM_FUNCS = ("add_noise_rand", "pink_noise")  # the results of these can't be cached
+MAX_DIMENSIONS = 1024  # longest side in pixels, embeds are displayed far smaller than this anyway
+FILTER_MAX_DIMENSIONS = {  # slower filters get a smaller cap, overridable with config["image_max_dimensions"]
+    "edge_detection": 768,
+    "emboss": 768,
+    "add_noise_rand": 768,
+    "pink_noise": 768,
+}
+RESIZE_FILTER = 2  # polaroid's triangle (bilinear) filter, much cheaper than lanczos for downscaling
+PNG_SIZE_LIMIT = 2 * 1024 * 1024  # bigger pngs are re-encoded as jpeg
+PIPELINE_LIMIT = 10  # max filters in one pipeline
+PIPELINE_FILTERS = {  # name: polaroid function
+    "solarize": "solarize",
+    "greyscale": "grayscale",
+    "grayscale": "grayscale",
+    "colourize": "colorize",
+    "colorize": "colorize",
+    "noise": "add_noise_rand",
+    "rainbow": "apply_gradient",
+    "desaturate": "desaturate",
+    "edges": "edge_detection",
+    "emboss": "emboss",
+    "invert": "invert",
+    "pink_noise": "pink_noise",
+    "pinknoise": "pink_noise",
+    "pink-noise": "pink_noise",
+    "sepia": "sepia",
+}
+
+
+def read_file(path: str):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:  # missing or unreadable, either way it's a cache miss
+        return None
+
+
+def write_file(path: str, data: bytes):
+    # write to a uniquely named temporary file first so that a half written file is never read and concurrent
+    # writes of the same key don't clobber each other's temporary file
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False)
+    try:
+        with f:
+            f.write(data)
+        os.replace(f.name, path)
+    except OSError:
+        with suppress(OSError):
+            os.remove(f.name)
+        raise
+
+
+def image_extension(image: bytes):
+    return "jpg" if image[:3] == b"\xff\xd8\xff" else "png"
+
+
+def prepare_image(image: bytes, max_dimensions: int):
+    """
+    Decodes an image and downscales it so that its longest side is at most `max_dimensions`.
+    Only the first frame of an animated gif is decoded, so the rest are never processed.
+    """
+    image = polaroid.Image(image)
+    if (longest := max(image.width, image.height)) > max_dimensions:
+        scale = max_dimensions / longest
+        image.resize(max(round(image.width * scale), 1), max(round(image.height * scale), 1), RESIZE_FILTER)
+    return image
+
+
+def encode_image(image: polaroid.Image):
+    """
+    Encodes an image as png, falling back to jpeg if the png is too large to upload quickly.
+    """
+    data = image.save_bytes()
+    if len(data) > PNG_SIZE_LIMIT:
+        try:
+            return image.save_bytes("jpeg")
+        except Exception:  # e.g. the colour type isn't supported by the jpeg encoder
+            pass
+    return data
+
+
+def polaroid_image_manip(image: bytes, operations: tuple, max_dimensions: int = MAX_DIMENSIONS):
+    """
+    Decodes an image once, applies each `(func, args, kwargs)` operation in order and encodes it once, timing every
+    stage. Runs in a worker process so that it never blocks the event loop.
+    """
+    timings = []
+    with utils.StopWatch() as sw:
+        image = prepare_image(image, max_dimensions)
+    timings.append(("decode", sw.elapsed))
+    for func, args, kwargs in operations:
+        with utils.StopWatch() as sw:
+            getattr(image, func)(*args, **kwargs)
+        timings.append((func, sw.elapsed))
+    with utils.StopWatch() as sw:
+        image = encode_image(image)
+    timings.append(("encode", sw.elapsed))
+    return image, timings
 
 
 class ImageManip(commands.Cog):
@@ -14,24 +124,124 @@ class ImageManip(commands.Cog):
     Image manipulation commands. Powered by [polaroid](https://github.com/Daggy1234/polaroid).
     **Note:** The image defaults to your avatar if it can't convert.
     """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.pool = utils.ProcessPool(bot.loop, max_workers=IMAGE_WORKERS)
+        self.queue_depth = 0
+        self.processed = 0
+        self.rejected = 0
+        bot.metric_sources["Image Processing"] = lambda: {
+            "workers": IMAGE_WORKERS, "queue depth": self.queue_depth, "processed": self.processed,
+            "rejected": self.rejected, "pool restarts": self.pool.restarts}
+
+        # results keyed by the hash of the source image, the filter and its arguments
+        self.cache = utils.LRUCache(maxbytes=IMAGE_CACHE_BYTES)
+        self.cache_path = config.get("image_cache_path")  # optional on-disk tier
+        if self.cache_path is not None:
+            os.makedirs(self.cache_path, exist_ok=True)
+        self.disk_hits = 0
+
+        self.max_dimensions = {**FILTER_MAX_DIMENSIONS, **config.get("image_max_dimensions", {})}
+        bot.metric_sources["Image Cache"] = lambda: {**self.cache.stats, "disk hits": self.disk_hits}
+
+    def cog_unload(self):
+        self.bot.metric_sources.pop("Image Processing", None)
+        self.bot.metric_sources.pop("Image Cache", None)
+        self.pool.shutdown()
+
+    @staticmethod
+    def cache_key(image: bytes, operations: tuple, max_dimensions: int):
+        operations = [(func, args, sorted(kwargs.items())) for func, args, kwargs in operations]
+        return hashlib.sha256(b"%s|%r|%d" % (hashlib.sha256(image).digest(), operations, max_dimensions)).hexdigest()
+
+    async def get_cached(self, key: str):
+        if (image := self.cache.get(key)) is not None:
+            return image
+        if self.cache_path is None:
+            return None
+        image = await self.bot.loop.run_in_executor(None, read_file, os.path.join(self.cache_path, key))
+        if image is not None:
+            self.disk_hits += 1
+            self.cache[key] = image
+        return image
+
+    async def set_cached(self, key: str, image: bytes):
+        self.cache[key] = image
+        if self.cache_path is not None:
+            with suppress(OSError):  # the disk cache is best effort, a full disk shouldn't fail the command
+                await self.bot.loop.run_in_executor(None, write_file, os.path.join(self.cache_path, key), image)
+
     async def do_polaroid_image_manip(self, ctx: CustomContext, image: bytes, func: str, filename: str, *args, **kwargs):
-        async with ctx.typing():
+        await self.do_polaroid_pipeline(ctx, image, ((func, args, kwargs),), filename=filename)
+
+    async def do_polaroid_pipeline(self, ctx: CustomContext, image: bytes, operations: tuple, *, filename: str):
+        # the strictest cap in the chain applies to the whole pipeline
+        max_dimensions = min(self.max_dimensions.get(func, MAX_DIMENSIONS) for func, _, _ in operations)
+        cacheable = not any(func in RANDOM_FUNCS for func, _, _ in operations)
+        key = self.cache_key(image, operations, max_dimensions) if cacheable else None
+        if key is not None:
             with utils.StopWatch() as sw:
-                image = polaroid.Image(image)
-                func = getattr(image, func)
-                await ctx.bot.loop.run_in_executor(None, func, *args, **kwargs)
-            embed, file = self.build_embed(ctx, image, filename=filename, elapsed=sw.elapsed)
+                cached = await self.get_cached(key)
+            if cached is not None:
+                embed, file = self.build_embed(ctx, cached, filename=filename, elapsed=sw.elapsed, cached=True)
+                return await ctx.send(embed=embed, file=file)
+
+        if self.queue_depth >= IMAGE_QUEUE_LIMIT:
+            self.rejected += 1
+            return await ctx.send("I'm processing too many images right now. Try again in a bit.")
+        async with ctx.typing():
+            self.queue_depth += 1
+            try:
+                with utils.StopWatch() as sw:
+                    image, timings = await self.pool.run(polaroid_image_manip, image, operations, max_dimensions)
+            except BrokenProcessPool:
+                return await ctx.send("Processing that image crashed its worker twice, it's probably too large.")
+            finally:
+                self.queue_depth -= 1
+            self.processed += 1
+            if key is not None:
+                await self.set_cached(key, image)
+            embed, file = self.build_embed(ctx, image, filename=filename, elapsed=sw.elapsed, timings=timings)
             await ctx.send(embed=embed, file=file)
 
     @staticmethod
-    def build_embed(ctx: CustomContext, image, *, filename: str, elapsed: int):
-        file = discord.File(BytesIO(image.save_bytes()), filename=f"{filename}.png")
+    def build_embed(ctx: CustomContext, image: bytes, *, filename: str, elapsed: float, timings: list = None,
+                    cached: bool = False):
+        filename = f"{filename}.{image_extension(image)}"
+        file = discord.File(BytesIO(image), filename=filename)
         embed = discord.Embed(colour=ctx.bot.embed_colour)
         embed.set_author(name=ctx.author, icon_url=ctx.author.avatar_url)
-        embed.set_image(url=f"attachment://{filename}.png")
-        embed.set_footer(text=f"Finished in {elapsed:.3f} seconds")
+        embed.set_image(url=f"attachment://{filename}")
+        footer = f"Finished in {elapsed:.3f} seconds"
+        if cached:
+            footer += " (cached)"
+        elif timings is not None and len(timings) > 3:  # only worth breaking down for pipelines
+            footer += "\n" + " → ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in timings)
+        embed.set_footer(text=footer)
         return embed, file
 
+    @commands.command(aliases=["pipeline"])
+    async def image(self, ctx: CustomContext, *, arguments):
+        """
+        Applies several filters to an image in one go.
+
+        `arguments` - The filters to apply in order, followed by the image.
+
+        Available filters: solarize, greyscale, colourize, noise, rainbow, desaturate, edges, emboss, invert,
+        pink-noise, sepia.
+        """
+        arguments = arguments.split()
+        operations = []
+        while arguments and (func := PIPELINE_FILTERS.get(arguments[0].lower())) is not None:
+            operations.append((func, (), {}))
+            arguments.pop(0)
+        if not operations:
+            raise commands.BadArgument("You need to specify at least one filter.")
+        if len(operations) > PIPELINE_LIMIT:
+            raise commands.BadArgument(f"You can only apply up to {PIPELINE_LIMIT} filters at once.")
+        image = await utils.ImageConverter(ctx.bot).convert(ctx, " ".join(arguments) or None)
+        await self.do_polaroid_pipeline(ctx, image, tuple(operations), filename="image")
+
     @commands.command()
     async def solarize(self, ctx: CustomContext, *, image=None):
         """
@@ -144,4 +354,4 @@ class ImageManip(commands.Cog):
 
 
 def setup(bot):
-    bot.add_cog(ImageManip())
+    bot.add_cog(ImageManip(bot))
@@ -9,6 +9,9 @@ from collections import Counter
 from utils import utils
 from utils.classes import CustomContext
 
+STATUS_TTL = 60
+DEFINE_TTL = 24 * 60 * 60
+
 
 class Info(commands.Cog):
     """
@@ -94,12 +97,13 @@ class Info(commands.Cog):
         """
         async with ctx.typing():
             if "-h" in flags or "--history" in flags:
-                async with ctx.bot.session.get("https://srhpyqt94yxb.statuspage.io/api/v2/incidents.json") as r:
-                    incidents = (await r.json())["incidents"]
+                _, r = await ctx.bot.http_cache.get_json(
+                    "https://srhpyqt94yxb.statuspage.io/api/v2/incidents.json", ttl=STATUS_TTL)
+                incidents = r["incidents"]
                 return await menus.MenuPages(utils.HistorySource(incidents, per_page=1), clear_reactions_after=True).start(ctx)
 
-            async with ctx.bot.session.get("https://srhpyqt94yxb.statuspage.io/api/v2/summary.json") as r:
-                summary = await r.json()
+            _, summary = await ctx.bot.http_cache.get_json(
+                "https://srhpyqt94yxb.statuspage.io/api/v2/summary.json", ttl=STATUS_TTL)
 
             # embed 1
             embed1 = discord.Embed(
@@ -162,9 +166,8 @@ class Info(commands.Cog):
         """
         async with ctx.typing():
             url = f"https://api.dictionaryapi.dev/api/v2/entries/en/{word}"
-            async with ctx.bot.session.get(url) as r:
-                response = await r.json()
-            if isinstance(response, dict):
+            _, response = await ctx.bot.http_cache.get_json(url, ttl=DEFINE_TTL)
+            if not isinstance(response, list):
                 return await ctx.send("Sorry pal, I couldn't find definitions for the word you were looking for.")
             await menus.MenuPages(utils.DefineSource(response[0]["meanings"], response[0]), clear_reactions_after=True).start(ctx)
 
@@ -6,23 +6,79 @@ import numpy as np
 import datetime
 import typing
 import textwrap
+import os
+import hashlib
 
 from discord.ext import commands, menus
+from concurrent.futures.process import BrokenProcessPool
 
 from utils import utils
-from utils.classes import CustomContext
+from utils.classes import CustomContext, PB_Bot
 from config import config
 
 MAX_FILESIZE = 100_000
 TODO_TASK_LENGTH = 200
 TODO_LIST_LENGTH = 100
+XKCD_TTL = 7 * 24 * 60 * 60  # comics never change
+XKCD_LATEST_TTL = 60 * 60
+XKCD_SEARCH_TTL = 24 * 60 * 60
+OCR_WORKERS = max((os.cpu_count() or 2) // 2, 1)
+OCR_QUEUE_LIMIT = OCR_WORKERS * 4  # jobs that can be waiting or running before new ones are rejected
+OCR_CACHE_SIZE = 512
+OCR_MAX_DIMENSIONS = 2000  # longest side in pixels, tesseract gains little from anything larger
+OCR_OPTIONS = {  # option: alias
+    "greyscale": "greyscale",
+    "grayscale": "greyscale",
+    "threshold": "threshold",
+    "full": "full",  # don't downscale
+}
 pytesseract.pytesseract.tesseract_cmd = config["tesseract_path"]
 
 
+def init_ocr_worker(tesseract_path: str):
+    pytesseract.pytesseract.tesseract_cmd = tesseract_path
+    # the pool provides the parallelism, so keep tesseract and opencv to one thread per worker
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    cv2.setNumThreads(1)
+
+
+def ocr_image(image: bytes, options: frozenset):
+    """
+    Decodes, preprocesses and reads an image. Runs in a worker process so that it never blocks the event loop.
+    """
+    img = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    if "full" not in options and (longest := max(img.shape[:2])) > OCR_MAX_DIMENSIONS:
+        scale = OCR_MAX_DIMENSIONS / longest
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if "greyscale" in options or "threshold" in options:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if "threshold" in options:
+        img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    return pytesseract.image_to_string(img)
+
+
 class Meta(commands.Cog):
     """
     Commands that don't belong to any specific category.
     """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.ocr_pool = utils.ProcessPool(
+            bot.loop, max_workers=OCR_WORKERS, initializer=init_ocr_worker, initargs=(config["tesseract_path"],))
+        self.ocr_cache = utils.LRUCache(OCR_CACHE_SIZE)  # results keyed by the hash of the image and the options
+        self.ocr_queue_depth = 0
+        self.ocr_processed = 0
+        self.ocr_rejected = 0
+        bot.metric_sources["OCR"] = lambda: {
+            "workers": OCR_WORKERS, "queue depth": self.ocr_queue_depth, "processed": self.ocr_processed,
+            "rejected": self.ocr_rejected, "pool restarts": self.ocr_pool.restarts, **self.ocr_cache.stats}
+
+    def cog_unload(self):
+        self.bot.metric_sources.pop("OCR", None)
+        self.ocr_pool.shutdown()
+
     @commands.command()
     async def mystbin(self, ctx: CustomContext, *, text: str = None):
         """
@@ -88,28 +144,26 @@ class Meta(commands.Cog):
         """
         async with ctx.typing():
             if isinstance(query, str):
-                async with ctx.bot.session.get(
-                        "https://www.explainxkcd.com/wiki/api.php",
-                        params={"action": "query", "list": "search", "format": "json", "srsearch": query,
-                                "srwhat": "title", "srlimit": "max"}) as resp:
-                    r = await resp.json()
-                    if result := r["query"]["search"]:
-                        num = result[0]["title"].split(":")[0]
-                    else:
-                        return await ctx.send("Couldn't find a comic with that query.")
+                _, r = await ctx.bot.http_cache.get_json(
+                    "https://www.explainxkcd.com/wiki/api.php",
+                    params={"action": "query", "list": "search", "format": "json", "srsearch": query,
+                            "srwhat": "title", "srlimit": "max"},
+                    ttl=XKCD_SEARCH_TTL)
+                if result := r["query"]["search"]:
+                    num = result[0]["title"].split(":")[0]
+                else:
+                    return await ctx.send("Couldn't find a comic with that query.")
             elif isinstance(query, int):
                 num = query
             else:
-                async with ctx.bot.session.get("https://xkcd.com/info.0.json") as resp:
-                    max_num = (await resp.json())["num"]
-                num = random.randint(1, max_num)
+                _, latest = await ctx.bot.http_cache.get_json("https://xkcd.com/info.0.json", ttl=XKCD_LATEST_TTL)
+                num = random.randint(1, latest["num"])
 
-            async with ctx.bot.session.get(f"https://xkcd.com/{num}/info.0.json") as resp:
-                if resp.status in range(400, 500):
-                    return await ctx.send("Couldn't find a comic with that number.")
-                elif resp.status >= 500:
-                    return await ctx.send("Server error.")
-                data = await resp.json()
+            status, data = await ctx.bot.http_cache.get_json(f"https://xkcd.com/{num}/info.0.json", ttl=XKCD_TTL)
+            if status in range(400, 500):
+                return await ctx.send("Couldn't find a comic with that number.")
+            elif status >= 500:
+                return await ctx.send("Server error.")
 
             embed = discord.Embed(
                 title=f"{data['safe_title']} (Comic Number `{data['num']}`)",
@@ -120,19 +174,44 @@ class Meta(commands.Cog):
             embed.set_footer(text="Created:")
             await ctx.send(embed=embed)
 
-    def _ocr(self, bytes_):
-        img = cv2.imdecode(np.fromstring(bytes_, np.uint8), 1)
-        return pytesseract.image_to_string(img)
+    async def _ocr(self, key: str, image: bytes, options: frozenset):
+        self.ocr_queue_depth += 1
+        try:
+            result = await self.ocr_pool.run(ocr_image, image, options)
+        finally:
+            self.ocr_queue_depth -= 1
+        self.ocr_processed += 1
+        if result is not None:
+            self.ocr_cache[key] = result
+        return result
 
     @commands.command()
-    async def ocr(self, ctx: CustomContext):
+    async def ocr(self, ctx: CustomContext, *options: str):
         """
         Read the contents of an attachment using `pytesseract`.
         **NOTE:** This can be *very* inaccurate at times.
+
+        `options` - Any of `greyscale`, `threshold` (black and white, good for screenshots) and `full` (don't downscale large images).
         """
         if not ctx.message.attachments:
             return await ctx.send("No attachment provided.")
-        ocr_result = await ctx.bot.loop.run_in_executor(None, self._ocr, await ctx.message.attachments[0].read())
+        if invalid := [option for option in options if option.lower() not in OCR_OPTIONS]:
+            return await ctx.send(f"Invalid option(s): {', '.join(f'`{option}`' for option in invalid)}")
+        image = await ctx.message.attachments[0].read()
+        options = frozenset(OCR_OPTIONS[option.lower()] for option in options)
+        key = hashlib.sha256(image).hexdigest() + "|" + ",".join(sorted(options))
+        # cached results don't need a worker, so they're served even when the pool is busy
+        if (ocr_result := self.ocr_cache.get(key)) is None:
+            if self.ocr_queue_depth >= OCR_QUEUE_LIMIT:
+                self.ocr_rejected += 1
+                return await ctx.send("I'm reading too many images right now. Try again in a bit.")
+            async with ctx.typing():
+                try:
+                    ocr_result = await self._ocr(key, image, options)
+                except BrokenProcessPool:
+                    return await ctx.send("Reading that image crashed its worker twice, it's probably too large.")
+        if ocr_result is None:
+            return await ctx.send("That attachment isn't an image I can read.")
         await ctx.send(f"Text to image result for **{ctx.author}**\n```{ocr_result}```")
 
     @commands.command()
@@ -211,4 +290,4 @@ class Meta(commands.Cog):
 
 
 def setup(bot):
-    bot.add_cog(Meta())
+    bot.add_cog(Meta(bot))
@@ -2,9 +2,16 @@ import discord
 import wavelink
 import humanize
 import datetime
-
-from discord.ext import commands, menus
+import asyncio
+import json
+import random
+import itertools
+import zlib
+import logging
+
+from discord.ext import commands, menus, tasks
 from contextlib import suppress
+from collections import OrderedDict, defaultdict
 from typing import Union
 
 from utils import utils
@@ -12,7 +19,18 @@ from utils.classes import PB_Bot, CustomContext
 from config import config
 
 DEFAULT_VOLUME = 40
-QUEUE_LIMIT = 100
+QUEUE_LIMIT = 5000
+NODE_CHECK_INTERVAL = 10  # seconds between checking node health
+REBALANCE_THRESHOLD = 2  # difference in players between the busiest and quietest node before players are moved
+REBALANCE_BATCH = 10  # max players moved per check, moving a playing player causes a short skip
+TRACK_CACHE_SIZE = 2048
+TRACK_CACHE_TTL = 6 * 60 * 60
+PLAYER_SNAPSHOT_INTERVAL = 5  # seconds, changes within this window are saved together
+PLAYER_STATE_TTL = 6 * 60 * 60  # sessions that haven't changed for this long aren't resumed
+RESTORE_BATCH = 5  # players reconnected at once on startup
+RESTORE_DELAY = 2  # seconds between batches, so voice connections don't hit ratelimits
+
+log = logging.getLogger(__name__)
 
 
 class Track(wavelink.Track):
@@ -27,6 +45,116 @@ class Track(wavelink.Track):
         self.requester = kwargs.get("requester")
 
 
+class SongQueue:
+    """
+    The songs of a player. Played songs (including the current one) are kept in `history` and the rest in `upcoming`,
+    so the position is always `len(history)`. Both are ordered dicts keyed by an entry id and every title maps to the
+    ids of its entries, so adding, advancing, rewinding and removing songs never scans the queue.
+    """
+    def __init__(self):
+        self.history = OrderedDict()  # entry id: track
+        self.upcoming = OrderedDict()
+        self.titles = defaultdict(set)  # title: entry ids
+        self.entry_ids = itertools.count()
+
+    @property
+    def position(self):
+        return len(self.history)
+
+    def __len__(self):
+        return len(self.history) + len(self.upcoming)
+
+    def __iter__(self):
+        return itertools.chain(self.history.values(), self.upcoming.values())
+
+    def __contains__(self, title: str):
+        return title in self.titles
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+        if index < len(self.history):
+            return self.history[self.key_at(self.history, index)]
+        return self.upcoming[self.key_at(self.upcoming, index - len(self.history))]
+
+    @staticmethod
+    def key_at(entries: OrderedDict, index: int):
+        # walk from whichever end is closer, so the songs around the position are found straight away
+        if index < len(entries) // 2:
+            return next(itertools.islice(entries, index, None))
+        return next(itertools.islice(reversed(entries), len(entries) - 1 - index, None))
+
+    def append(self, track: Track):
+        entry_id = next(self.entry_ids)
+        self.upcoming[entry_id] = track
+        self.titles[str(track)].add(entry_id)
+
+    def extend(self, tracks: list):
+        for track in tracks:
+            self.append(track)
+
+    def advance(self):
+        """
+        Moves the next song into the history and returns it, or returns `None` if there are no more songs.
+        """
+        if not self.upcoming:
+            return None
+        entry_id, track = self.upcoming.popitem(last=False)
+        self.history[entry_id] = track
+        return track
+
+    def rewind(self, amount: int):
+        """
+        Moves the last `amount` played songs back to the front of the upcoming songs.
+        """
+        for _ in range(min(amount, len(self.history))):
+            entry_id, track = self.history.popitem()
+            self.upcoming[entry_id] = track
+            self.upcoming.move_to_end(entry_id, last=False)
+
+    def remove(self, title: str):
+        """
+        Removes every song with a title, returning how many were removed.
+        """
+        if (entry_ids := self.titles.pop(title, None)) is None:
+            return 0
+        for entry_id in entry_ids:
+            if self.history.pop(entry_id, None) is None:
+                del self.upcoming[entry_id]
+        return len(entry_ids)
+
+    def shuffle(self):
+        entries = list(self.upcoming.items())
+        random.shuffle(entries)
+        self.upcoming = OrderedDict(entries)
+
+    def move(self, source: int, destination: int):
+        """
+        Moves an upcoming song. Both indexes are relative to the upcoming songs. Only the songs between each index and
+        the nearest end of the queue are walked, so moving songs to or from either end is O(1).
+        """
+        entry_id = self.key_at(self.upcoming, source)
+        track = self.upcoming.pop(entry_id)
+        remaining = len(self.upcoming)
+        destination = min(destination, remaining)
+        if destination >= remaining // 2:
+            # append it, then move the songs that belong after it back behind it
+            self.upcoming[entry_id] = track
+            for key in reversed(list(itertools.islice(reversed(self.upcoming), 1, remaining - destination + 1))):
+                self.upcoming.move_to_end(key)
+        else:
+            # prepend it, then move the songs that belong before it back in front of it
+            self.upcoming[entry_id] = track
+            self.upcoming.move_to_end(entry_id, last=False)
+            for key in reversed(list(itertools.islice(self.upcoming, 1, destination + 1))):
+                self.upcoming.move_to_end(key, last=False)
+        return track
+
+
 class Player(wavelink.Player):
     """
     Custom player class.
@@ -42,10 +170,61 @@ class Player(wavelink.Player):
         self.is_locked = False
         self.dj = None
 
-        self.queue = []
+        self.queue = SongQueue()
         self.menus = []
         self.volume = DEFAULT_VOLUME
-        self.queue_position = 0
+        self.dirty = False  # whether the state has changed since the last snapshot
+        self.announcements = []  # now playing messages waiting to be sent
+        self.announce_lock = asyncio.Lock()
+
+    @property
+    def queue_position(self):
+        return self.queue.position
+
+    # state
+
+    async def set_volume(self, vol: int):
+        await super().set_volume(vol)
+        self.dirty = True
+
+    async def set_eq(self, equalizer: wavelink.Equalizer):
+        await super().set_eq(equalizer)
+        self.dirty = True
+
+    async def set_pause(self, pause: bool):
+        await super().set_pause(pause)
+        self.dirty = True
+
+    def snapshot(self):
+        """
+        Serializes everything needed to resume the session as compressed JSON.
+        """
+        def dump_tracks(tracks):
+            return [[track.id, track.info, getattr(track.requester, "id", None)] for track in tracks]
+
+        return zlib.compress(json.dumps({
+            "channel": self.channel_id,
+            "session_chan": self.session_chan.id,
+            "dj": self.dj,
+            "locked": self.is_locked,
+            "volume": self.volume,
+            "equalizer": [self.equalizer.name, self.equalizer.raw],
+            "paused": self.is_paused,
+            "position": int(self.position),
+            # the playing track isn't always the last one in the history, e.g. after it's removed from the queue
+            "current": dump_tracks([self.current])[0] if self.current is not None else None,
+            "history": dump_tracks(self.queue.history.values()),
+            "upcoming": dump_tracks(self.queue.upcoming.values()),
+        }, separators=(",", ":")).encode())
+
+    async def save(self):
+        # cleared before the write so that changes made while it's in flight still mark the player dirty
+        self.dirty = False
+        try:
+            await self.bot.redis.set(f"player_state:{self.guild_id}", self.snapshot(), expire=PLAYER_STATE_TTL)
+        except Exception:
+            self.dirty = True  # retried on the next snapshot
+            raise
 
     async def start(self, ctx: CustomContext, song: Union[wavelink.TrackPlaylist, list]):
         # connect to voice
@@ -57,14 +236,10 @@ class Player(wavelink.Player):
 
         # add the first song
         if isinstance(song, wavelink.TrackPlaylist):
-            for track in song.tracks:
-                track = Track(track.id, track.info, requester=ctx.author)
-                self.queue.append(track)
-            now_playing = song.tracks[0]
+            self.queue.extend([Track(track.id, track.info, requester=ctx.author) for track in song.tracks[:QUEUE_LIMIT]])
         else:
-            track = Track(song[0].id, song[0].info, requester=ctx.author)
-            self.queue.append(track)
-            now_playing = track
+            self.queue.append(Track(song[0].id, song[0].info, requester=ctx.author))
+        now_playing = self.queue[self.queue.position]
 
         # embed
         duration = datetime.timedelta(milliseconds=now_playing.length)
@@ -81,36 +256,43 @@ class Player(wavelink.Player):
         await ctx.send(embed=embed)
 
         # start playing
-        self.queue_position += 1
-        await self.play(now_playing)
+        await self.play(self.queue.advance())
 
         # finalise
         self.session_chan = ctx.channel
         self.dj = ctx.author.id
         self.session_started = True
+        self.dirty = True
 
     async def do_next(self):
-        with suppress((discord.Forbidden, discord.HTTPException, AttributeError)):
-            await self.now_playing.delete()
-
-        try:
-            song = self.queue[self.queue_position]
-        except IndexError:  # There are no more songs in the queue.
+        if (song := self.queue.advance()) is None:  # There are no more songs in the queue.
             await self.destroy()
             return
+        self.dirty = True
 
-        self.queue_position += 1
-
-        embed = discord.Embed(title="Now Playing:", description=f"{song}", colour=self.bot.embed_colour)
-        embed.set_footer(text=f"Requested by {song.requester}")
-        self.now_playing = await self.session_chan.send(embed=embed)
+        # start the next song straight away and update the messages afterwards
         await self.play(song)
+        self.announcements.append(self.bot.loop.create_task(self.announce(song)))
+
+    async def announce(self, song: Track):
+        try:
+            async with self.announce_lock:  # keeps the messages in order when songs are skipped quickly
+                with suppress((discord.Forbidden, discord.HTTPException, AttributeError)):
+                    await self.now_playing.delete()
+                embed = discord.Embed(title="Now Playing:", description=f"{song}", colour=self.bot.embed_colour)
+                embed.set_footer(text=f"Requested by {song.requester}")
+                with suppress((discord.Forbidden, discord.HTTPException, AttributeError)):
+                    self.now_playing = await self.session_chan.send(embed=embed)
+        finally:
+            self.announcements.remove(asyncio.current_task())
 
     async def do_previous(self):
-        self.queue_position -= 2
+        self.queue.rewind(2)  # the current song and the one before it
         await self.stop()
 
     async def destroy(self):
+        for announcement in self.announcements:
+            announcement.cancel()
         with suppress((discord.Forbidden, discord.HTTPException, AttributeError)):
             await self.now_playing.delete()
 
@@ -118,7 +300,13 @@ class Player(wavelink.Player):
         for menu in menus_:
             menu.stop()
 
+        self.dirty = False
         await super().destroy()
+        if self.bot.redis is not None:  # after disconnecting, so that a redis outage can't keep the player around
+            try:
+                await self.bot.redis.delete(f"player_state:{self.guild_id}")
+            except Exception:
+                log.exception("Failed to delete the player state for guild %s", self.guild_id)
 
 
 # def dj_check():
@@ -179,10 +367,34 @@ class Music(commands.Cog):
     Music commands.
     """
     def __init__(self, bot: PB_Bot):
-        CustomContext.player = property(lambda ctx: bot.wavelink.get_player(ctx.guild.id, cls=Player))
+        CustomContext.player = property(lambda ctx: self.get_player(ctx.guild.id))
         self.bot = bot
+        self.available_nodes = set()  # identifiers of the nodes that were available at the last check
+        self.rebalancing = False
+        self.migrations = 0
+        self.track_cache = utils.LRUCache(TRACK_CACHE_SIZE, ttl=TRACK_CACHE_TTL)  # normalized query: search results
+        self.searches = {}  # normalized query: task
+        self.use_redis = config.get("track_cache_redis", False)
+        bot.metric_sources["Track Search Cache"] = lambda: self.track_cache.stats
+        bot.metric_sources["Lavalink Nodes"] = lambda: {
+            node.identifier: f"{'up' if node.is_available else 'down'}, {len(node.players)} players, "
+                             f"load {self.node_load(node):.1f}"
+            for node in bot.wavelink.nodes.values()}
+        bot.shutdown_hooks["Music"] = self.save_players
         bot.loop.create_task(self.start_nodes())
 
+    def cog_unload(self):
+        self.bot.metric_sources.pop("Lavalink Nodes", None)
+        self.bot.metric_sources.pop("Track Search Cache", None)
+        self.bot.shutdown_hooks.pop("Music", None)
+        self.check_nodes.cancel()
+        self.save_dirty_players.cancel()
+
+    async def cog_after_invoke(self, ctx: CustomContext):
+        # commands change the queue, dj and lock directly, so assume they changed something
+        if ctx.guild and (player := self.bot.wavelink.players.get(ctx.guild.id)) is not None:
+            player.dirty = True
+
     async def cog_check(self, ctx: CustomContext):
         if not ctx.guild:
             raise commands.NoPrivateMessage
@@ -199,6 +411,8 @@ class Music(commands.Cog):
             return False
         return True
 
+    # nodes
+
     async def start_nodes(self):
         await self.bot.wait_until_ready()
 
@@ -207,18 +421,224 @@ class Music(commands.Cog):
             for node in previous_nodes.values():
                 await node.destroy()
 
-        node = await self.bot.wavelink.initiate_node(**config["wavelink_node"])
-        node.set_hook(self.on_node_event)
+        node_configs = config.get("wavelink_nodes", [config.get("wavelink_node")])
+        results = await asyncio.gather(
+            *[self.bot.wavelink.initiate_node(**node_config) for node_config in node_configs if node_config],
+            return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.error("Failed to start a lavalink node", exc_info=result)
+            else:
+                result.set_hook(self.on_node_event)
+        self.available_nodes = {node.identifier for node in self.bot.wavelink.nodes.values() if node.is_available}
+        self.check_nodes.start()
+        await self.restore_players()
+        self.save_dirty_players.start()
+
+    @staticmethod
+    def node_load(node: wavelink.Node):
+        """
+        Lavalink's own penalty score (players, cpu, nulled and deficit frames), or the player count before the node has
+        sent any stats.
+        """
+        if node.stats is None:
+            return len(Music.connected_players(node))
+        return node.stats.penalty.total
+
+    @staticmethod
+    def connected_players(node: wavelink.Node):
+        # players that were created but never connected (or have disconnected) put no load on a node
+        return [player for player in node.players.values() if player.is_connected]
+
+    def best_node(self, exclude: wavelink.Node = None):
+        nodes = [node for node in self.bot.wavelink.nodes.values() if node.is_available and node is not exclude]
+        return min(nodes, key=self.node_load, default=None)
+
+    def get_player(self, guild_id: int):
+        if (player := self.bot.wavelink.players.get(guild_id)) is not None:
+            return player
+        # new players go to the least loaded node
+        node = self.best_node()
+        return self.bot.wavelink.get_player(guild_id, cls=Player, node_id=node.identifier if node else None)
+
+    async def move_player(self, player: Player, node: wavelink.Node):
+        try:
+            await player.change_node(node.identifier)
+        except wavelink.WavelinkException:
+            log.exception("Failed to move the player for guild %s to node %s", player.guild_id, node.identifier)
+        else:
+            self.migrations += 1
+
+    @tasks.loop(seconds=NODE_CHECK_INTERVAL)
+    async def check_nodes(self):
+        nodes = list(self.bot.wavelink.nodes.values())
+        available = {node.identifier for node in nodes if node.is_available}
+
+        # migrate players off nodes that went down
+        for node in nodes:
+            if node.is_available or not node.players:
+                continue
+            for player in list(node.players.values()):
+                if (target := self.best_node(exclude=node)) is None:
+                    break  # nowhere to move them to, wait for a node to come back
+                await self.move_player(player, target)
+
+        # spread players onto nodes that were added or came back
+        if available - self.available_nodes:
+            self.rebalancing = True
+        if self.rebalancing:
+            for _ in range(REBALANCE_BATCH):
+                candidates = [node for node in nodes if node.is_available]
+                if len(candidates) < 2:
+                    self.rebalancing = False
+                    break
+                players = {node.identifier: self.connected_players(node) for node in candidates}
+                busiest = max(candidates, key=lambda node: len(players[node.identifier]))
+                quietest = min(candidates, key=lambda node: len(players[node.identifier]))
+                if len(players[busiest.identifier]) - len(players[quietest.identifier]) <= REBALANCE_THRESHOLD:
+                    self.rebalancing = False
+                    break
+                # idle players first, they can be moved without an audible skip
+                player = min(players[busiest.identifier], key=lambda player: player.is_playing)
+                await self.move_player(player, quietest)
+        self.available_nodes = available
 
     async def on_node_event(self, event):
         if isinstance(event, (wavelink.TrackEnd, wavelink.TrackException)):
             await event.player.do_next()
 
+    # player state
+
+    def session_players(self):
+        return [player for player in self.bot.wavelink.players.values()
+                if isinstance(player, Player) and player.session_started and player.is_connected]
+
+    @tasks.loop(seconds=PLAYER_SNAPSHOT_INTERVAL)
+    async def save_dirty_players(self):
+        if self.bot.redis is None:
+            return
+        for player in self.session_players():
+            if player.dirty:
+                try:
+                    await player.save()
+                except Exception:
+                    log.exception("Failed to save the player state for guild %s", player.guild_id)
+
+    async def save_players(self):
+        """
+        Saves every session with its latest position, called when the bot shuts down.
+        """
+        if self.bot.redis is None:
+            return
+        await asyncio.gather(*[player.save() for player in self.session_players()], return_exceptions=True)
+
+    async def restore_players(self):
+        """
+        Resumes the sessions saved by a previous process for the guilds this process is responsible for, a few at a
+        time.
+        """
+        if self.bot.redis is None:
+            return
+        states = []
+        async for key in self.bot.redis.iscan(match="player_state:*"):
+            guild_id = int(key.decode().split(":")[1])
+            if self.bot.get_guild(guild_id) is not None and guild_id not in self.bot.wavelink.players:
+                states.append((guild_id, key))
+
+        for i in range(0, len(states), RESTORE_BATCH):
+            if i:
+                await asyncio.sleep(RESTORE_DELAY)
+            batch = states[i:i + RESTORE_BATCH]
+            results = await asyncio.gather(
+                *[self.restore_player(guild_id, key) for guild_id, key in batch], return_exceptions=True)
+            for (guild_id, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    log.error("Failed to restore the player for guild %s", guild_id, exc_info=result)
+
+    async def restore_player(self, guild_id: int, key: bytes):
+        if (data := await self.bot.redis.get(key)) is None:
+            return
+        state = json.loads(zlib.decompress(data))
+        guild = self.bot.get_guild(guild_id)
+        voice_channel = guild.get_channel(state["channel"])
+        session_chan = guild.get_channel(state["session_chan"])
+        if voice_channel is None or session_chan is None or state.get("current") is None:
+            await self.bot.redis.delete(key)
+            return
+
+        def load_tracks(tracks):
+            return [Track(id_, info, requester=guild.get_member(requester_id)) for id_, info, requester_id in tracks]
+
+        player = self.get_player(guild_id)
+        player.queue.extend(load_tracks(state["history"] + state["upcoming"]))
+        for _ in state["history"]:
+            player.queue.advance()
+        player.session_chan = session_chan
+        player.dj = state["dj"]
+        player.is_locked = state["locked"]
+        player.session_started = True
+
+        await player.connect(voice_channel.id)
+        await player.set_volume(state["volume"])
+        name, levels = state["equalizer"]
+        await player.set_eq(wavelink.Equalizer.build(levels=levels, name=name))
+        await player.play(load_tracks([state["current"]])[0], start=state["position"])
+        if state["paused"]:
+            await player.set_pause(True)
+
+    # track searches
+
+    @staticmethod
+    def normalize_query(query: str):
+        query = " ".join(query.split())
+        return query if query.startswith(("http://", "https://")) else query.lower()  # urls can be case-sensitive
+
+    async def search(self, query: str):
+        """
+        Searches youtube for a query. Results are cached and identical searches running at the same time share one
+        request to lavalink.
+        """
+        query = self.normalize_query(query)
+        if (results := self.track_cache.get(query)) is not None:
+            return results
+        if (search := self.searches.get(query)) is None:
+            search = self.searches[query] = self.bot.loop.create_task(self._search(query))
+            search.add_done_callback(lambda _: self.searches.pop(query, None))
+        return await asyncio.shield(search)
+
+    async def _search(self, query: str):
+        key = f"track_search:{query}"
+        if self.use_redis and self.bot.redis is not None:
+            if (raw := await self.bot.redis.get(key, encoding="utf-8")) is not None:
+                results = self.track_cache[query] = self.load_results(json.loads(raw))
+                return results
+
+        results = await self.bot.wavelink.get_tracks(f"ytsearch:{query}")
+        if not results:  # don't cache failed searches
+            return results
+        self.track_cache[query] = results
+        if self.use_redis and self.bot.redis is not None:
+            await self.bot.redis.set(key, json.dumps(self.dump_results(results)), expire=TRACK_CACHE_TTL)
+        return results
+
+    @staticmethod
+    def dump_results(results: Union[wavelink.TrackPlaylist, list]):
+        if isinstance(results, wavelink.TrackPlaylist):
+            return {"playlist": results.data}
+        return {"tracks": [[track.id, track.info] for track in results]}
+
+    @staticmethod
+    def load_results(data: dict):
+        if "playlist" in data:
+            return wavelink.TrackPlaylist(data["playlist"])
+        return [wavelink.Track(id_, info) for id_, info in data["tracks"]]
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
         if before.channel and not after.channel:  # the member was in a vc and the member left the vc
-            player = self.bot.wavelink.get_player(member.guild.id, cls=Player)
-            if member.id == player.dj:
+            # don't create a player for a guild that isn't using music
+            player = self.bot.wavelink.players.get(member.guild.id)
+            if player is not None and member.id == player.dj:
                 player.dj = None
 
     @commands.command()
@@ -308,16 +728,39 @@ class Music(commands.Cog):
 
         `query` - The song to remove from the queue.
         """
-        query_results = await ctx.bot.wavelink.get_tracks(f"ytsearch:{query}")
+        query_results = await self.search(query)
         if not query_results:
             return await ctx.send(f"Could not find any songs with that query.")
-        track = Track(query_results[0].id, query_results[0].info, requester=ctx.author)
-        for track_, position in enumerate(ctx.player.queue):
-            if str(track_) == str(track):
-                ctx.player.queue.remove(track_)
-                if position < ctx.player.queue_position:
-                    ctx.player.queue_position -= 1
-        await ctx.send(f"Removed all songs with the name `{track}` from the queue. Queue length: `{len(ctx.player.queue)}`")
+        title = str(query_results[0])
+        if not ctx.player.queue.remove(title):
+            return await ctx.send(f"`{title}` isn't in the queue.")
+        await ctx.send(f"Removed all songs with the name `{title}` from the queue. Queue length: `{len(ctx.player.queue)}`")
+
+    @is_privileged()
+    @songqueue.command()
+    async def shuffle(self, ctx: CustomContext):
+        """
+        Shuffles the songs that haven't been played yet.
+        """
+        ctx.player.queue.shuffle()
+        await ctx.send(f"Shuffled `{len(ctx.player.queue.upcoming)}` songs.")
+
+    @is_privileged()
+    @songqueue.command()
+    async def move(self, ctx: CustomContext, source: int, destination: int):
+        """
+        Moves a song that hasn't been played yet to another position in the queue.
+
+        `source` - The number of the song to move.
+        `destination` - The number to move it to.
+        """
+        position = ctx.player.queue_position
+        if not (position < source <= len(ctx.player.queue) and position < destination <= len(ctx.player.queue)):
+            return await ctx.send(f"Both numbers have to be songs that haven't been played yet "
+                                  f"(`{position + 1}` to `{len(ctx.player.queue)}`).")
+        # queue numbers start at 1 and include the songs that have been played
+        track = ctx.player.queue.move(source - position - 1, destination - position - 1)
+        await ctx.send(f"Moved `{track}` to position `{destination}`.")
 
     @is_privileged()
     @commands.command()
@@ -330,7 +773,7 @@ class Music(commands.Cog):
         if len(ctx.player.queue) >= QUEUE_LIMIT:
             return await ctx.send(f"Sorry, only `{QUEUE_LIMIT}` songs can be in the queue at a time.")
 
-        query_results = await ctx.bot.wavelink.get_tracks(f"ytsearch:{query}")
+        query_results = await self.search(query)
         if not query_results:
             return await ctx.send(f"Could not find any songs with that query.")
 
@@ -338,11 +781,10 @@ class Music(commands.Cog):
             return await ctx.player.start(ctx, query_results)
 
         if isinstance(query_results, wavelink.TrackPlaylist):
-            for track in query_results.tracks:
-                track = Track(track.id, track.info, requester=ctx.author)
-                ctx.player.queue.append(track)
+            tracks = query_results.tracks[:QUEUE_LIMIT - len(ctx.player.queue)]
+            ctx.player.queue.extend([Track(track.id, track.info, requester=ctx.author) for track in tracks])
             playlist_name = query_results.data['playlistInfo']['name']
-            await ctx.send(f"Added playlist `{playlist_name}` with `{len(query_results.tracks)}` songs to the queue. "
+            await ctx.send(f"Added playlist `{playlist_name}` with `{len(tracks)}` songs to the queue. "
                            f"Queue length: `{len(ctx.player.queue)}`")
         else:
             track = Track(query_results[0].id, query_results[0].info, requester=ctx.author)
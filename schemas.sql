@@ -21,7 +21,74 @@ CREATE TABLE IF NOT EXISTS command_stats (
     users text
 );
 
+CREATE TABLE IF NOT EXISTS command_usage (
+    bucket   timestamp,
+    command  text,
+    guild_id bigint,
+    user_id  bigint,
+    uses     integer DEFAULT 0,
+    PRIMARY KEY (bucket, command, guild_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS command_usage_guild_idx ON command_usage (guild_id, bucket);
+
+-- daily rollups of command_usage, kept up to date by each dump so that the stats commands don't have to sum the
+-- hourly rows of every user
+CREATE TABLE IF NOT EXISTS command_usage_daily (
+    day     date,
+    command text,
+    uses    integer DEFAULT 0,
+    PRIMARY KEY (day, command)
+);
+
+CREATE TABLE IF NOT EXISTS guild_command_usage_daily (
+    guild_id bigint,
+    day      date,
+    command  text,
+    uses     integer DEFAULT 0,
+    PRIMARY KEY (guild_id, day, command)
+);
+
+CREATE TABLE IF NOT EXISTS guild_user_usage_daily (
+    guild_id bigint,
+    day      date,
+    user_id  bigint,
+    uses     integer DEFAULT 0,
+    PRIMARY KEY (guild_id, day, user_id)
+);
+
+-- backfill the rollups from the usage recorded before they existed, only ever runs while they're empty
+INSERT INTO command_usage_daily
+    SELECT bucket::date, command, SUM(uses) FROM command_usage
+    WHERE NOT EXISTS (SELECT 1 FROM command_usage_daily) GROUP BY 1, 2
+    ON CONFLICT DO NOTHING;
+INSERT INTO guild_command_usage_daily
+    SELECT guild_id, bucket::date, command, SUM(uses) FROM command_usage
+    WHERE NOT EXISTS (SELECT 1 FROM guild_command_usage_daily) GROUP BY 1, 2, 3
+    ON CONFLICT DO NOTHING;
+INSERT INTO guild_user_usage_daily
+    SELECT guild_id, bucket::date, user_id, SUM(uses) FROM command_usage
+    WHERE NOT EXISTS (SELECT 1 FROM guild_user_usage_daily) GROUP BY 1, 2, 3
+    ON CONFLICT DO NOTHING;
+
 CREATE TABLE IF NOT EXISTS blacklisted_users (
     user_id bigint PRIMARY KEY,
     reason text
 );
+
+-- the reason isn't sent because pg_notify payloads are limited to 8000 bytes, listeners fetch it instead
+CREATE OR REPLACE FUNCTION notify_blacklist() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('blacklist', json_build_object('op', TG_OP, 'user_id', OLD.user_id)::text);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('blacklist', json_build_object('op', TG_OP, 'user_id', NEW.user_id)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS blacklist_notify ON blacklisted_users;
+CREATE TRIGGER blacklist_notify
+    AFTER INSERT OR UPDATE OR DELETE ON blacklisted_users
+    FOR EACH ROW EXECUTE PROCEDURE notify_blacklist();
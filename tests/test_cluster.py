@@ -0,0 +1,60 @@
+import sys
+import time
+import unittest
+from unittest import mock
+
+import cluster
+
+
+def exit_worker(shard_ids: list, shard_count: int, delay: float):
+    # stands in for run_worker, a worker that dies straight away
+    sys.exit(1)
+
+
+class CountingCluster(cluster.Cluster):
+    """
+    Stops itself once it has spawned `limit` workers.
+    """
+    def __init__(self, *args, limit: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limit = limit
+        self.spawned = []
+
+    def spawn(self, worker: int, delay: float = 0):
+        super().spawn(worker, delay)
+        self.spawned.append(worker)
+        if len(self.spawned) >= self.limit:
+            self.running = False
+
+
+class TestShardRanges(unittest.TestCase):
+    def test_every_shard_once_in_order(self):
+        for shard_count in range(1, 40):
+            for workers in range(1, 12):
+                ranges = cluster.shard_ranges(shard_count, workers)
+                self.assertEqual([shard for shard_ids in ranges for shard in shard_ids], list(range(shard_count)))
+
+    def test_balanced(self):
+        sizes = [len(shard_ids) for shard_ids in cluster.shard_ranges(10, 4)]
+        self.assertEqual(sizes, [3, 3, 2, 2])
+
+    def test_no_empty_workers(self):
+        self.assertEqual(cluster.shard_ranges(2, 8), [[0], [1]])
+
+
+class TestRestartLoop(unittest.TestCase):
+    @mock.patch.object(cluster, "run_worker", exit_worker)
+    def test_dead_workers_are_restarted(self):
+        c = CountingCluster(shard_count=4, workers=2, limit=5)
+        started = time.monotonic()
+        c.run()
+        self.assertLess(time.monotonic() - started, 30)
+        # both workers start, then the dead ones keep being respawned
+        self.assertEqual(c.spawned[:2], [0, 1])
+        self.assertEqual(len(c.spawned), 5)
+        self.assertTrue(all(not process.is_alive() for process in c.processes.values()))
+        self.assertTrue(all(process.exitcode == 1 for process in c.processes.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
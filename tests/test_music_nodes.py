@@ -0,0 +1,111 @@
+import types
+import unittest
+
+from cogs.Music import Music, REBALANCE_THRESHOLD
+
+
+class StubNode:
+    """
+    A lavalink node that hasn't sent any stats, so its load is its connected player count.
+    """
+    def __init__(self, identifier: str, *, available: bool = True):
+        self.identifier = identifier
+        self.is_available = available
+        self.players = {}  # guild id: player
+        self.stats = None
+
+
+class StubPlayer:
+    def __init__(self, nodes: dict, node: StubNode, guild_id: int, *, connected: bool = True, playing: bool = True):
+        self.nodes = nodes
+        self.node = node
+        self.guild_id = guild_id
+        self.is_connected = connected
+        self.is_playing = playing
+        node.players[guild_id] = self
+
+    async def change_node(self, identifier: str):
+        del self.node.players[self.guild_id]
+        self.node = self.nodes[identifier]
+        self.node.players[self.guild_id] = self
+
+
+class TestNodes(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.nodes = {}
+        self.guild_ids = iter(range(1, 1000))
+        self.cog = Music.__new__(Music)  # without __init__, which starts the nodes
+        self.cog.bot = types.SimpleNamespace(wavelink=types.SimpleNamespace(nodes=self.nodes))
+        self.cog.available_nodes = set()
+        self.cog.rebalancing = False
+        self.cog.migrations = 0
+
+    def add_node(self, identifier: str, *, available: bool = True):
+        node = self.nodes[identifier] = StubNode(identifier, available=available)
+        return node
+
+    def add_players(self, node: StubNode, amount: int, **kwargs):
+        return [StubPlayer(self.nodes, node, next(self.guild_ids), **kwargs) for _ in range(amount)]
+
+    async def check_nodes(self):
+        await Music.check_nodes.coro(self.cog)
+
+    def test_best_node_skips_unavailable_and_excluded_nodes(self):
+        a, b, c = self.add_node("a"), self.add_node("b", available=False), self.add_node("c")
+        self.add_players(a, 3)
+        self.assertIs(self.cog.best_node(), c)
+        self.assertIs(self.cog.best_node(exclude=c), a)
+        b.is_available = True
+        self.assertIs(self.cog.best_node(exclude=c), b)
+
+    def test_best_node_ignores_unconnected_players(self):
+        a, b = self.add_node("a"), self.add_node("b")
+        self.add_players(a, 5, connected=False)
+        self.add_players(b, 1)
+        self.assertIs(self.cog.best_node(), a)
+
+    async def test_players_leave_a_node_that_went_down(self):
+        a, b, c = self.add_node("a"), self.add_node("b"), self.add_node("c")
+        self.add_players(a, 4)
+        self.cog.available_nodes = {"a", "b", "c"}
+        a.is_available = False
+        await self.check_nodes()
+        self.assertEqual(len(a.players), 0)
+        self.assertEqual((len(b.players), len(c.players)), (2, 2))
+        self.assertEqual(self.cog.migrations, 4)
+
+    async def test_players_wait_when_every_node_is_down(self):
+        a = self.add_node("a", available=False)
+        self.add_players(a, 2)
+        await self.check_nodes()
+        self.assertEqual(len(a.players), 2)
+
+    async def test_rebalances_onto_a_node_that_came_back(self):
+        a, b = self.add_node("a"), self.add_node("b")
+        self.add_players(a, 10)
+        self.cog.available_nodes = {"a"}
+        await self.check_nodes()
+        self.assertLessEqual(len(a.players) - len(b.players), REBALANCE_THRESHOLD)
+        self.assertFalse(self.cog.rebalancing)
+        self.assertEqual(self.cog.available_nodes, {"a", "b"})
+
+    async def test_rebalancing_ignores_unconnected_players(self):
+        a, b = self.add_node("a"), self.add_node("b")
+        connected = self.add_players(a, REBALANCE_THRESHOLD)
+        self.add_players(a, 6, connected=False)
+        self.cog.available_nodes = {"a"}
+        await self.check_nodes()
+        self.assertEqual(len(b.players), 0)
+        self.assertTrue(all(player.node is a for player in connected))
+
+    async def test_idle_players_are_moved_first(self):
+        a, b = self.add_node("a"), self.add_node("b")
+        self.add_players(a, REBALANCE_THRESHOLD)
+        idle = self.add_players(a, 1, playing=False)[0]
+        self.cog.available_nodes = {"a"}
+        await self.check_nodes()
+        self.assertEqual(list(b.players.values()), [idle])
+
+
+if __name__ == "__main__":
+    unittest.main()
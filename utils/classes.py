@@ -9,50 +9,81 @@ import asyncpg
 import json
 import aioredis
 import typing
-
-from collections import Counter
+import uuid
+import ast
+import sys
+import importlib
+import importlib.util
+import time
+import bisect
+import heapq
+import logging
+
+from collections import Counter, defaultdict, OrderedDict
 from discord.ext import commands, tasks
 from copy import deepcopy
 from pyfiglet import Figlet
+from urllib.parse import urlencode
 
-from .utils import StopWatch
+from .utils import StopWatch, PrefixMatcher, LRUCache, MISSING, get_imported_modules, get_cog_info, \
+    ImageConverter
 from config import config
 
 # constants
 
 EMPTY_GUILD_CACHE = {"prefixes": []}
 DEFAULT_PREFIXES = ["pb"]
+DEFAULT_PREFIX_MATCHER = PrefixMatcher(DEFAULT_PREFIXES)
 EMBED_COLOUR = 0x01ad98
+GUILD_CACHE_SIZE = 10_000
+INVALIDATION_CHANNEL = "cache_invalidation"
+COMMAND_STATS_KEYS = ("top_commands_today", "top_commands_overall", "top_users_today", "top_users_overall")
+GUILD_CACHE_TTL = 60 * 60
+BLACKLIST_RETRY_DELAY = 5  # seconds between attempts to listen for blacklist changes again
 BOT_ID = "719907834120110182"
 PERMISSIONS = 104189127
 DESCRIPTION = "An easy to use, multipurpose discord bot written in Python by PB#4162."
+LAZY_COGS = ["cogs.Admin", "cogs.Meta", "cogs.ImageManip"]  # cogs with heavy imports
 COMMITS_URL = "https://api.github.com/repos/PB4162/PB-Bot/commits"
+COMMITS_TTL = 10 * 60
+HTTP_CACHE_SIZE = 1024
+HTTP_CACHE_TTL = 60
+HTTP_CACHE_STALE_TTL = 24 * 60 * 60  # how long expired responses are kept in redis to revalidate against
+HTTP_CACHE_ERROR_TTL = 10  # client errors such as a 404 may only be temporary
+HTTP_CATEGORIES = {  # category: connector limits and total timeout in seconds, overridable with config["http"]
+    "default": {"limit": 50, "limit_per_host": 10, "timeout": 15},
+    "images": {"limit": 100, "limit_per_host": 20, "timeout": 10},  # avatars, emojis and attachments
+    "api": {"limit": 30, "limit_per_host": 5, "timeout": 10},  # third party JSON APIs
+    "paste": {"limit": 10, "limit_per_host": 4, "timeout": 20},
+}
+HTTP_DNS_CACHE_TTL = 5 * 60
+HTTP_KEEPALIVE_TIMEOUT = 30
+HTTP_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # upper bounds in seconds
+HTTP_MAX_HOSTS = 256  # hosts with recorded stats, the least recently requested is dropped first
+HTTP_SUMMARY_HOSTS = 8  # busiest hosts shown in metrics, embed fields are limited to 1024 characters
+
+log = logging.getLogger(__name__)
 
 
 async def get_prefix(bot, message: discord.Message):
     """
     Get prefix function.
     """
-    if not message.guild or (cache := await bot.cache.get_guild_info(message.guild.id)) is None:
-        prefixes = DEFAULT_PREFIXES
+    if not message.guild:
+        matcher = DEFAULT_PREFIX_MATCHER
     else:
-        prefixes = cache["prefixes"]
-        if not prefixes:
-            prefixes = DEFAULT_PREFIXES
-    prefixes = sorted(prefixes, key=len)
-    for prefix in prefixes:
-        match = re.match(rf"^({prefix}\s*).*", message.content, flags=re.IGNORECASE)
-        if match:
-            return match.group(1)
+        matcher = await bot.cache.get_prefix_matcher(message.guild.id)
+    if prefix := matcher.match(message.content):
+        return prefix
     # fallback
     return commands.when_mentioned(bot, message)
 
 
-class PB_Bot(commands.Bot):
+class PB_Bot(commands.AutoShardedBot):
     """
     Subclassed bot.
     """
-    def __init__(self):
+    def __init__(self, *, shard_ids: list = None, shard_count: int = None):
         intents = discord.Intents.default()
         intents.members = True
         super().__init__(
@@ -60,7 +91,9 @@ class PB_Bot(commands.Bot):
             case_insensitive=True,
             intents=intents,
             owner_id=config["owner_id"],
-            description=DESCRIPTION
+            description=DESCRIPTION,
+            shard_ids=shard_ids,
+            shard_count=shard_count or config.get("shard_count")
         )
 
         # case-insensitive cogs
@@ -68,19 +101,36 @@ class PB_Bot(commands.Bot):
 
         # general stuff
         self.start_time = datetime.datetime.now()
-        self.session = aiohttp.ClientSession()
+        self.http_client = HTTPClient()
         self.wavelink = wavelink.Client(bot=self)
         self.coglist = [f"cogs.{item[:-3]}" for item in os.listdir("cogs") if item != "__pycache__"] + ["jishaku"]
+        self.lazy_coglist = config.get("lazy_cogs", LAZY_COGS)
+        self.lazy_extensions = {}  # extension: names of its placeholder cogs
+        self.lazy_sources = {}  # qualified command name: (file, first line, last line) of stub commands
+        self.import_times = {}
         self.command_list = []
         self.figlet = Figlet()
         self.embed_colour = EMBED_COLOUR
+        self._mention_regex = None
 
-        # database connections
-        self.pool = asyncio.get_event_loop().run_until_complete(asyncpg.create_pool(**config["postgresql"]))
-        self.redis = asyncio.get_event_loop().run_until_complete(aioredis.create_redis_pool(config["redis"]))
+        # metrics
+        self.message_filter_stats = Counter(rejected=0, processed=0)
+        self.metric_sources = {"Message Filter": lambda: dict(self.message_filter_stats)}
+        self.shutdown_hooks = {}  # name: coroutine function awaited in close()
+
+        # database connections, created in startup()
+        self.pool = None
+        self.redis = None
+        self.startup_times = {}
 
         # cache
         self.cache = Cache(self)
+        self.metric_sources["Guild Info Cache"] = lambda: self.cache.guild_cache.stats
+        self.metric_sources["Startup Times (seconds)"] = lambda: self.startup_times
+        self.metric_sources["Image Downloads"] = lambda: ImageConverter.cache.stats
+        self.http_cache = HTTPCache(self)
+        self.metric_sources["HTTP Cache"] = lambda: self.http_cache.stats
+        self.metric_sources["HTTP Hosts"] = lambda: self.http_client.summary()
 
         # links
         self.github_url = "https://github.com/PB4162/PB-Bot"
@@ -137,6 +187,14 @@ class PB_Bot(commands.Bot):
     async def get_context(self, message: discord.Message, *, cls=None):
         return await super().get_context(message, cls=cls or CustomContext)
 
+    async def invoke(self, ctx):
+        if ctx.command is not None and isinstance(ctx.command.cog, LazyCog):
+            # load the extension before any checks run, so that only the real command's checks (and the global
+            # check once) run
+            self.load_lazy_extension(ctx.command.cog.extension)
+            ctx = await self.get_context(ctx.message)
+        await super().invoke(ctx)
+
     # events
 
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
@@ -146,7 +204,11 @@ class PB_Bot(commands.Bot):
     async def on_message(self, message: discord.Message):
         if message.author.bot:
             return
-        if re.fullmatch(f"^(<@!?{self.user.id}>)\s*", message.content):
+        if not await self.could_be_command(message):
+            self.message_filter_stats["rejected"] += 1
+            return
+        self.message_filter_stats["processed"] += 1
+        if self.mention_regex.fullmatch(message.content):
             ctx = await self.get_context(message)
             return await ctx.invoke(self.get_command("prefix"))
         await self.process_commands(message)
@@ -155,11 +217,27 @@ class PB_Bot(commands.Bot):
         await self.cache.delete_guild_info(guild.id)
 
     async def on_command(self, ctx):
-        self.cache.command_stats["top_commands_today"].update({ctx.command.qualified_name: 1})
-        self.cache.command_stats["top_commands_overall"].update({ctx.command.qualified_name: 1})
+        self.cache.record_command(ctx.command.qualified_name, ctx.author.id, ctx.guild and ctx.guild.id)
+
+    # message pre-filter
 
-        self.cache.command_stats["top_users_today"].update({str(ctx.author.id): 1})
-        self.cache.command_stats["top_users_overall"].update({str(ctx.author.id): 1})
+    @property
+    def mention_regex(self):
+        if self._mention_regex is None:
+            self._mention_regex = re.compile(rf"<@!?{self.user.id}>\s*")
+        return self._mention_regex
+
+    async def could_be_command(self, message: discord.Message):
+        """
+        Rejects messages that can't possibly be commands before any context is built.
+        """
+        if not message.content:
+            return False
+        if not message.guild:
+            matcher = DEFAULT_PREFIX_MATCHER
+        else:
+            matcher = await self.cache.get_prefix_matcher(message.guild.id)
+        return matcher.could_match(message.content) or self.mention_regex.match(message.content) is not None
 
     # ping helpers
 
@@ -183,11 +261,12 @@ class PB_Bot(commands.Bot):
 
     @tasks.loop(minutes=30)
     async def presence_update(self):
+        members = sum(guild.member_count or 0 for guild in self.guilds)  # avoids building the list of every user
         await self.change_presence(
             status=discord.Status.idle,
             activity=discord.Activity(
                 type=discord.ActivityType.watching,
-                name=f"{len(self.guilds)} servers and {len(self.users)} users")
+                name=f"{len(self.guilds)} servers and {members} members")
         )
 
     @presence_update.before_loop
@@ -196,7 +275,7 @@ class PB_Bot(commands.Bot):
 
     @tasks.loop(hours=24)
     async def clear_cmd_stats(self):
-        await self.cache.clear_cmd_stats()
+        await self.cache.run_dumps(self.cache.clear_cmd_stats)
 
     @clear_cmd_stats.before_loop
     async def clear_command_stats_before(self):
@@ -206,18 +285,22 @@ class PB_Bot(commands.Bot):
         dt = midnight - datetime.datetime.now()
         await asyncio.sleep(dt.total_seconds())
 
-    @tasks.loop(minutes=5)
+    @tasks.loop(seconds=10)
     async def dump_cmd_stats(self):
-        await self.cache.dump_cmd_stats()
+        await self.cache.run_dumps(self.cache.dump_cmd_stats, self.cache.dump_command_usage)
+
+    @tasks.loop(seconds=30)
+    async def dump_cache(self):
+        await self.cache.run_dumps(self.cache.dump_guild_info, self.cache.dump_todos)
 
     # pastebin
 
     async def mystbin(self, data):
-        async with self.session.post("https://mystb.in/documents", data=data) as r:
+        async with self.http_client.session("paste").post("https://mystb.in/documents", data=data) as r:
             return f"https://mystb.in/{(await r.json())['key']}"
 
     async def hastebin(self, data):
-        async with self.session.post("https://hastebin.com/documents", data=data) as r:
+        async with self.http_client.session("paste").post("https://hastebin.com/documents", data=data) as r:
             return f"https://hastebin.com/{(await r.json())['key']}"
 
     # other
@@ -231,8 +314,7 @@ class PB_Bot(commands.Bot):
         return commands.check(predicate)
 
     async def get_recent_commits(self, limit: int = 4):
-        async with self.session.get(COMMITS_URL) as r:
-            commits = await r.json()
+        _, commits = await self.http_cache.get_json(COMMITS_URL, ttl=COMMITS_TTL)
         return commits[:limit]
 
     async def schemas(self):
@@ -249,6 +331,7 @@ class PB_Bot(commands.Bot):
         return subcommands
 
     def refresh_command_list(self):
+        self.command_list.clear()
         for command in self.commands:
             self.command_list.append(str(command))
             self.command_list.extend([alias for alias in command.aliases])
@@ -256,21 +339,158 @@ class PB_Bot(commands.Bot):
                 self.command_list.extend(self.get_all_subcommands(command))
 
     async def close(self):
-        await self.cache.dump_all()
+        for name, hook in self.shutdown_hooks.items():
+            try:
+                await hook()
+            except Exception:
+                log.exception("Shutdown hook %s failed", name)
+        if self.pool is not None and self.redis is not None:  # startup() failed before connecting otherwise
+            await self.cache.dump_all()
+            await self.cache.close()
+        await self.http_client.close()
         await super().close()
 
-    def run(self, *args, **kwargs):
-        for cog in self.coglist:
-            self.load_extension(cog)
-
-        self.loop.run_until_complete(self.schemas())
-        self.loop.run_until_complete(self.cache.load_all())
+    @property
+    def session(self):
+        return self.http_client.session()
+
+    # extensions
+
+    def load_extension(self, name):
+        """
+        Loads an extension, replacing its placeholder cogs if it was lazy and recording how long each of its
+        dependencies took to import.
+        """
+        dependencies = {}
+        modules = get_imported_modules(ast.parse(self.read_extension(name)))
+        for module in modules:
+            if module in sys.modules:
+                continue
+            with StopWatch() as sw:
+                try:
+                    importlib.import_module(module)
+                except ImportError:  # load_extension will raise a proper error for this
+                    break
+            dependencies[module] = sw.elapsed
+
+        placeholders = self.lazy_extensions.pop(name, [])
+        for cog in placeholders:
+            self.remove_cog(cog)
+        with StopWatch() as sw:
+            try:
+                super().load_extension(name)
+            except Exception:
+                if placeholders:  # put the stubs back so that the commands don't disappear
+                    self.add_lazy_extension(name)
+                raise
+        filepath = f"{name.replace('.', '/')}.py"
+        self.lazy_sources = {command: source for command, source in self.lazy_sources.items()
+                             if source[0] != filepath}
+        self.import_times[name] = {"total": sum(dependencies.values()) + sw.elapsed, "dependencies": dependencies}
+
+    def add_lazy_extension(self, name):
+        """
+        Registers placeholder cogs with stub commands for an extension without importing it, built from its source
+        so that help can show them. The extension is loaded the first time one of its commands is used.
+        """
+        cogs = get_cog_info(self.read_extension(name))
+        filepath = f"{name.replace('.', '/')}.py"
+
+        async def callback(_, ctx: CustomContext):
+            # only reached when a stub is invoked directly, `invoke` swaps stubs for the real commands before this
+            self.load_lazy_extension(name)
+            ctx = await self.get_context(ctx.message)  # resolve the real command, subcommands included
+            if ctx.command is not None:
+                await ctx.command.invoke(ctx)  # the real command runs its own checks
+
+        def make_commands(info, parent=None):
+            kwargs = {"name": info["name"], "aliases": info["aliases"], "help": info["help"], "usage": info["usage"],
+                      "hidden": info["hidden"], "ignore_extra": True, "parent": parent}
+            if info["commands"] is None:
+                command = commands.Command(callback, **kwargs)
+            else:
+                command = commands.Group(callback, invoke_without_command=True, **kwargs)
+            if parent is not None:
+                parent.add_command(command)
+            self.lazy_sources[command.qualified_name] = (filepath, *info["lines"])
+            yield command
+            for subcommand in info["commands"] or []:
+                yield from make_commands(subcommand, command)
+
+        self.lazy_extensions[name] = []
+        for cog in cogs:
+            # every command has to be a class attribute, like in a normal cog, for the cog to bind its subcommands
+            attrs = {"__doc__": cog["description"]}
+            for info in cog["commands"]:
+                for command in make_commands(info):
+                    attrs[f"command_{len(attrs)}"] = command
+            placeholder = type(cog["name"], (LazyCog,), attrs)()
+            placeholder.extension = name
+            self.add_cog(placeholder)
+            self.lazy_extensions[name].append(cog["name"])
 
-        self.refresh_command_list()
+    @staticmethod
+    def read_extension(name):
+        """
+        Reads an extension's source without importing it.
+        """
+        try:
+            spec = importlib.util.find_spec(name)
+        except ImportError:  # a parent package doesn't exist
+            spec = None
+        if spec is None or spec.origin is None:
+            raise commands.ExtensionNotFound(name)
+        with open(spec.origin) as f:
+            return f.read()
+
+    def load_lazy_extension(self, name):
+        if name not in self.extensions:
+            self.load_extension(name)
+            self.refresh_command_list()
+
+    # startup
+
+    async def timed(self, phase: str, coro):
+        """
+        Awaits a coroutine and records how long it took in the startup timing breakdown.
+        """
+        with StopWatch() as sw:
+            result = await coro
+        self.startup_times[phase] = sw.elapsed
+        return result
+
+    async def startup(self):
+        """
+        Connects to the databases concurrently, then loads the caches in parallel.
+        """
+        with StopWatch() as sw:
+            self.pool, self.redis = await asyncio.gather(
+                self.timed("postgresql", asyncpg.create_pool(**config["postgresql"])),
+                self.timed("redis", aioredis.create_redis_pool(config["redis"]))
+            )
+            await self.timed("schemas", self.schemas())
+            await self.cache.load_all()
+        self.startup_times["total"] = sw.elapsed + self.startup_times.get("cogs", 0)
 
         self.presence_update.start()
         self.dump_cmd_stats.start()
+        self.dump_cache.start()
         self.clear_cmd_stats.start()
+
+    async def start(self, *args, **kwargs):
+        await self.startup()
+        await super().start(*args, **kwargs)
+
+    def run(self, *args, **kwargs):
+        with StopWatch() as sw:
+            for cog in self.coglist:
+                if cog in self.lazy_coglist:
+                    self.add_lazy_extension(cog)
+                else:
+                    self.load_extension(cog)
+        self.startup_times["cogs"] = sw.elapsed
+
+        self.refresh_command_list()
         super().run(*args, **kwargs)
 
 
@@ -278,48 +498,177 @@ class Cache:
     def __init__(self, bot: PB_Bot):
         self.bot = bot
 
-        self.guild_cache = {}
-        self.command_stats = {"top_commands_today": Counter(), "top_commands_overall": Counter(),
-                              "top_users_today": Counter(), "top_users_overall": Counter()}
-        self.blacklist = []
+        self.preload_guild_info = config.get("preload_guild_info", False)
+        if self.preload_guild_info:
+            self.guild_cache = LRUCache()
+        else:
+            self.guild_cache = LRUCache(GUILD_CACHE_SIZE, ttl=GUILD_CACHE_TTL, on_evict=self.on_guild_info_evict)
+        self.guild_info_loads = {}
+        self.prefix_matchers = {}
+        self.dirty_guilds = {}
+        self.guild_info_lock = asyncio.Lock()  # held while dumping or deleting, so deletes can't be undone by a dump
+        self.command_stats = {key: Counter() for key in COMMAND_STATS_KEYS}  # not dumped yet
+        self.command_usage = Counter()  # (bucket, command, guild_id, user_id): uses
+        self.blacklist = {}
+        self.blacklist_listener = None
+        self.blacklist_reload = None
         self.todos = {}
+        self.dirty_todos = set()
+        self.todo_lock = asyncio.Lock()
         self.socketstats = Counter()
+        self.shard_socketstats = defaultdict(Counter)
+
+        # used to ignore invalidations sent by this process
+        self.origin = uuid.uuid4().hex
+        self.invalidation_listener = None
 
     async def load_all(self):
-        await self.load_guild_info()
-        await self.load_cmd_stats()
-        await self.load_blacklist()      # todo add spam violation counter
-        await self.load_todos()
+        if self.invalidation_listener is None:
+            self.invalidation_listener = self.bot.loop.create_task(self.listen_for_invalidations())
+        await asyncio.gather(
+            self.bot.timed("guild info", self.load_guild_info()),
+            self.bot.timed("blacklist", self.load_blacklist()),      # todo add spam violation counter
+            self.bot.timed("todos", self.load_todos())
+        )
 
     async def dump_all(self):
-        await self.dump_guild_info()
-        await self.dump_cmd_stats()
-        await self.dump_todos()
+        await self.run_dumps(self.dump_guild_info, self.dump_cmd_stats, self.dump_command_usage, self.dump_todos)
+
+    @staticmethod
+    async def run_dumps(*dumps):
+        """
+        Runs each dump, logging failures instead of raising so that the dump loops keep running. A failed dump keeps
+        its changes and writes them on the next run.
+        """
+        for dump in dumps:
+            try:
+                await dump()
+            except Exception:
+                log.exception("%s failed, retrying on the next dump", dump.__name__)
+
+    async def close(self):
+        if self.invalidation_listener is not None:
+            await self.bot.redis.unsubscribe(INVALIDATION_CHANNEL)
+            self.invalidation_listener = None
+        if self.blacklist_reload is not None:
+            self.blacklist_reload.cancel()
+        if self.blacklist_listener is not None:
+            self.blacklist_listener.remove_termination_listener(self.on_blacklist_listener_terminated)
+            await self.blacklist_listener.remove_listener("blacklist", self.on_blacklist_notify)
+            await self.bot.pool.release(self.blacklist_listener)
+            self.blacklist_listener = None
+
+    # invalidation
+
+    async def publish_invalidation(self, type_: str, ids: list):
+        """
+        Tells the other processes to drop their cached copies of the given entries.
+        """
+        await self.bot.redis.publish_json(INVALIDATION_CHANNEL, {"origin": self.origin, "type": type_, "ids": ids})
+
+    async def listen_for_invalidations(self):
+        channel, = await self.bot.redis.subscribe(INVALIDATION_CHANNEL)
+        async for data in channel.iter(encoding="utf-8", decoder=json.loads):
+            if data["origin"] == self.origin:
+                continue
+            try:
+                if data["type"] == "guild_info":
+                    for guild_id in data["ids"]:
+                        await self.invalidate_guild_info(guild_id)
+            except Exception:  # one bad message shouldn't stop the listener
+                log.exception("Failed to apply invalidation %r", data)
 
     # guild info
 
     async def load_guild_info(self):
+        if not self.preload_guild_info:  # loaded on demand by get_guild_info instead
+            return
         data = await self.bot.pool.fetch("SELECT * FROM guild_info")
         for entry in data:
             self.guild_cache[entry["guild_id"]] = {k: v for k, v in list(entry.items())[1:]}  # skip the guild_id
+        self.prefix_matchers.clear()
+
+    async def fetch_guild_info(self, guild_id: int):
+        entry = await self.bot.pool.fetchrow("SELECT * FROM guild_info WHERE guild_id = $1", guild_id)
+        # the guild might have been created or deleted while the query was running
+        if (info := self.guild_cache.peek(guild_id, MISSING)) is not MISSING:
+            return info
+        info = None if entry is None else {k: v for k, v in list(entry.items())[1:]}  # None is cached as well
+        self.guild_cache[guild_id] = info
+        return info
 
     async def dump_guild_info(self):
-        items = deepcopy(self.guild_cache).items()
-        for guild_id, data in items:
-            await self.bot.pool.execute("UPDATE guild_info SET prefixes = $1 WHERE guild_id = $2", data["prefixes"], guild_id)
-            # idk how to make this dynamic
+        """
+        Writes the guilds that changed since the last dump in a single batch.
+        """
+        async with self.guild_info_lock:
+            dirty, self.dirty_guilds = self.dirty_guilds, {}
+            data = [(guild_id, list(info["prefixes"])) for guild_id, info in dirty.items()]
+            if not data:
+                return
+            try:
+                await self.bot.pool.executemany(
+                    "INSERT INTO guild_info (guild_id, prefixes) VALUES ($1, $2) "
+                    "ON CONFLICT (guild_id) DO UPDATE SET prefixes = EXCLUDED.prefixes", data)
+            except Exception:
+                for guild_id, info in dirty.items():  # try again on the next dump
+                    self.dirty_guilds.setdefault(guild_id, info)
+                raise
+        await self.publish_invalidation("guild_info", list(dirty))
 
     async def create_guild_info(self, guild_id: int):
-        await self.bot.pool.execute("INSERT INTO guild_info VALUES ($1)", guild_id)
-        self.guild_cache[guild_id] = deepcopy(EMPTY_GUILD_CACHE)
-        return self.guild_cache[guild_id]
+        info = self.guild_cache[guild_id] = deepcopy(EMPTY_GUILD_CACHE)
+        self.dirty_guilds[guild_id] = info
+        return info
 
     async def delete_guild_info(self, guild_id: int):
-        await self.bot.pool.execute("DELETE FROM guild_info WHERE guild_id = $1", guild_id)
-        self.guild_cache.pop(guild_id, None)
+        async with self.guild_info_lock:
+            await self.bot.pool.execute("DELETE FROM guild_info WHERE guild_id = $1", guild_id)
+            self.guild_cache[guild_id] = None
+            self.dirty_guilds.pop(guild_id, None)
+            self.prefix_matchers.pop(guild_id, None)
+        await self.publish_invalidation("guild_info", [guild_id])
+
+    async def invalidate_guild_info(self, guild_id: int):
+        if guild_id in self.dirty_guilds:  # local changes win until they're dumped
+            return
+        self.prefix_matchers.pop(guild_id, None)
+        if self.guild_cache.pop(guild_id, MISSING) is not MISSING and self.preload_guild_info:
+            await self.fetch_guild_info(guild_id)  # misses aren't loaded on demand when everything is preloaded
 
     async def get_guild_info(self, guild_id: int):
-        return self.guild_cache.get(guild_id, None)
+        """
+        Returns the guild's info or `None` if the guild has none. Unless everything was preloaded, misses are loaded
+        from the database with at most one query in flight per guild.
+        """
+        if (info := self.guild_cache.get(guild_id, MISSING)) is not MISSING:
+            return info
+        if self.preload_guild_info:
+            return None
+        if (info := self.dirty_guilds.get(guild_id)) is not None:  # evicted before it was dumped
+            self.guild_cache[guild_id] = info
+            return info
+        if (load := self.guild_info_loads.get(guild_id)) is None:
+            load = self.guild_info_loads[guild_id] = self.bot.loop.create_task(self.fetch_guild_info(guild_id))
+            load.add_done_callback(lambda _: self.guild_info_loads.pop(guild_id, None))
+        return await asyncio.shield(load)
+
+    def on_guild_info_evict(self, guild_id: int, _):
+        self.prefix_matchers.pop(guild_id, None)
+
+    async def get_prefix_matcher(self, guild_id: int):
+        """
+        Returns the prefix matcher for a guild. Matchers are built once and rebuilt only when the prefixes change.
+        """
+        # looking up the guild info keeps busy guilds recently used, so they aren't the first to be evicted
+        if (matcher := self.prefix_matchers.get(guild_id)) is not None \
+                and self.guild_cache.get(guild_id, MISSING) is not MISSING:
+            return matcher
+        cache = await self.get_guild_info(guild_id)
+        if cache is None or not cache["prefixes"]:
+            return DEFAULT_PREFIX_MATCHER
+        matcher = self.prefix_matchers[guild_id] = PrefixMatcher(cache["prefixes"])
+        return matcher
 
     async def cleanup_guild_info(self, guild_id: int):
         cache = await self.get_guild_info(guild_id)
@@ -327,73 +676,165 @@ class Cache:
             await self.delete_guild_info(guild_id)
 
     async def add_prefix(self, guild_id: int, prefix: str):
-        await self.bot.pool.execute("UPDATE guild_info SET prefixes = array_append(prefixes, $1) WHERE guild_id = $2", prefix, guild_id)
-        (await self.get_guild_info(guild_id))["prefixes"].append(prefix)
+        info = await self.get_guild_info(guild_id)
+        info["prefixes"].append(prefix)
+        self.prefix_matchers.pop(guild_id, None)
+        self.dirty_guilds[guild_id] = info
 
     async def remove_prefix(self, guild_id: int, prefix: str):
-        await self.bot.pool.execute("UPDATE guild_info SET prefixes = array_remove(prefixes, $1) WHERE guild_id = $2", prefix, guild_id)
-        (await self.get_guild_info(guild_id))["prefixes"].remove(prefix)
+        info = await self.get_guild_info(guild_id)
+        info["prefixes"].remove(prefix)
+        self.prefix_matchers.pop(guild_id, None)
+        self.dirty_guilds[guild_id] = info
 
         await self.cleanup_guild_info(guild_id)
 
     async def clear_prefixes(self, guild_id: int):
-        await self.bot.pool.execute("UPDATE guild_info SET prefixes = '{}' WHERE guild_id = $1", guild_id)
-        (await self.get_guild_info(guild_id))["prefixes"].clear()
+        info = await self.get_guild_info(guild_id)
+        info["prefixes"].clear()
+        self.prefix_matchers.pop(guild_id, None)
+        self.dirty_guilds[guild_id] = info
 
         await self.cleanup_guild_info(guild_id)
 
     # command stats
 
-    async def load_cmd_stats(self):
-        top_cmds_today = await self.bot.redis.hgetall("top_commands_today", encoding="utf-8")
-        top_users_today = await self.bot.redis.hgetall("top_users_today", encoding="utf-8")
-        top_cmds_overall = await self.bot.redis.hgetall("top_commands_overall", encoding="utf-8")
-        top_users_overall = await self.bot.redis.hgetall("top_users_overall", encoding="utf-8")
-        self.command_stats["top_commands_today"].update({k: int(v) for k, v in top_cmds_today.items()})
-        self.command_stats["top_users_today"].update({k: int(v) for k, v in top_users_today.items()})
-        self.command_stats["top_commands_overall"].update({k: int(v) for k, v in top_cmds_overall.items()})
-        self.command_stats["top_users_overall"].update({k: int(v) for k, v in top_users_overall.items()})
+    def record_command(self, command: str, user_id: int, guild_id: int = None):
+        for key, field in (("top_commands_today", command), ("top_commands_overall", command),
+                           ("top_users_today", str(user_id)), ("top_users_overall", str(user_id))):
+            self.command_stats[key][field] += 1
+
+        bucket = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        self.command_usage[(bucket, command, guild_id or 0, user_id)] += 1  # 0 is used for direct messages
+
+    async def get_cmd_stats(self, key: str):
+        """
+        Returns the stats shared by all processes plus the ones that haven't been dumped yet.
+        """
+        stats = Counter({k: int(v) for k, v in (await self.bot.redis.hgetall(key, encoding="utf-8")).items()})
+        stats.update(self.command_stats[key])
+        return stats
 
     async def dump_cmd_stats(self):
-        top_cmds_today = dict(self.command_stats["top_commands_today"])
-        top_users_today = dict(self.command_stats["top_users_today"])
-        top_cmds_overall = dict(self.command_stats["top_commands_overall"])
-        top_users_overall = dict(self.command_stats["top_users_overall"])
-        if top_cmds_today:  # will error if it's empty
-            await self.bot.redis.hmset_dict("top_commands_today", top_cmds_today)
-        if top_users_today:
-            await self.bot.redis.hmset_dict("top_users_today", top_users_today)
-        if top_cmds_overall:
-            await self.bot.redis.hmset_dict("top_commands_overall", top_cmds_overall)
-        if top_users_overall:
-            await self.bot.redis.hmset_dict("top_users_overall", top_users_overall)
+        """
+        Adds the stats recorded since the last dump to redis with `HINCRBY`s in one MULTI/EXEC transaction, so that
+        either all of them are applied or none are and a failed dump can be merged back without double counting.
+        """
+        deltas = self.command_stats
+        self.command_stats = {key: Counter() for key in COMMAND_STATS_KEYS}
+        transaction = self.bot.redis.multi_exec()
+        for key, counter in deltas.items():
+            for field, amount in counter.items():
+                transaction.hincrby(key, field, amount)
+        try:
+            await transaction.execute()
+        except Exception:
+            for key, counter in deltas.items():  # try again on the next dump
+                self.command_stats[key].update(counter)
+            raise
+
+    async def dump_command_usage(self):
+        """
+        Bulk inserts the hourly usage buckets with `COPY`, adding to buckets that already exist, and adds them to the
+        daily rollups in the same transaction.
+        """
+        usage, self.command_usage = self.command_usage, Counter()
+        if not usage:
+            return
+        records = [(*key, uses) for key, uses in usage.items()]
+        try:
+            async with self.bot.pool.acquire() as connection:
+                async with connection.transaction():
+                    await connection.execute(
+                        "CREATE TEMPORARY TABLE command_usage_staging (LIKE command_usage) ON COMMIT DROP")
+                    await connection.copy_records_to_table(
+                        "command_usage_staging", records=records,
+                        columns=("bucket", "command", "guild_id", "user_id", "uses"))
+                    await connection.execute(
+                        "INSERT INTO command_usage SELECT * FROM command_usage_staging "
+                        "ON CONFLICT (bucket, command, guild_id, user_id) "
+                        "DO UPDATE SET uses = command_usage.uses + EXCLUDED.uses")
+                    await connection.execute(
+                        "INSERT INTO command_usage_daily "
+                        "SELECT bucket::date, command, SUM(uses) FROM command_usage_staging GROUP BY 1, 2 "
+                        "ON CONFLICT (day, command) DO UPDATE SET uses = command_usage_daily.uses + EXCLUDED.uses")
+                    await connection.execute(
+                        "INSERT INTO guild_command_usage_daily "
+                        "SELECT guild_id, bucket::date, command, SUM(uses) FROM command_usage_staging GROUP BY 1, 2, 3 "
+                        "ON CONFLICT (guild_id, day, command) "
+                        "DO UPDATE SET uses = guild_command_usage_daily.uses + EXCLUDED.uses")
+                    await connection.execute(
+                        "INSERT INTO guild_user_usage_daily "
+                        "SELECT guild_id, bucket::date, user_id, SUM(uses) FROM command_usage_staging GROUP BY 1, 2, 3 "
+                        "ON CONFLICT (guild_id, day, user_id) "
+                        "DO UPDATE SET uses = guild_user_usage_daily.uses + EXCLUDED.uses")
+        except Exception:
+            self.command_usage.update(usage)  # try again on the next dump
+            raise
 
     async def clear_cmd_stats(self):
-        # dump
-        yesterday = datetime.date.today() - datetime.timedelta(days=1)
-        cmds = json.dumps(dict(self.command_stats["top_commands_today"]))
-        users = json.dumps(dict(self.command_stats["top_users_today"]))
-        await self.bot.pool.execute("INSERT INTO command_stats VALUES ($1, $2, $3)", yesterday, cmds, users)
-
-        # clear
-        self.command_stats["top_commands_today"].clear()
-        self.command_stats["top_users_today"].clear()
+        # history is kept in command_usage, so the daily hashes can just be reset
+        await self.dump_cmd_stats()
+        await self.bot.redis.delete("top_commands_today", "top_users_today")
 
     # blacklist
 
     async def load_blacklist(self):
-        self.blacklist = [entry["user_id"] for entry in await self.bot.pool.fetch("SELECT user_id FROM blacklisted_users")]
+        # listen before loading so that no changes are missed in between
+        if self.blacklist_listener is None:
+            connection = await self.bot.pool.acquire()
+            await connection.add_listener("blacklist", self.on_blacklist_notify)
+            connection.add_termination_listener(self.on_blacklist_listener_terminated)
+            self.blacklist_listener = connection
+        data = await self.bot.pool.fetch("SELECT user_id, reason FROM blacklisted_users")
+        self.blacklist = {entry["user_id"]: entry["reason"] for entry in data}
+
+    def on_blacklist_listener_terminated(self, connection):
+        # changes made while the connection was down were never notified, so listen again and reload everything
+        self.blacklist_listener = None
+        if self.blacklist_reload is None or self.blacklist_reload.done():
+            self.blacklist_reload = self.bot.loop.create_task(self.reload_blacklist(connection))
+
+    async def reload_blacklist(self, connection):
+        try:
+            await self.bot.pool.release(connection)
+        except Exception:  # the connection is already dead, the reload mustn't depend on releasing it cleanly
+            log.exception("Couldn't release the terminated blacklist listener")
+        while True:
+            try:
+                await self.load_blacklist()
+                return
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                log.exception("Couldn't reload the blacklist, retrying in %s seconds", BLACKLIST_RETRY_DELAY)
+                await asyncio.sleep(BLACKLIST_RETRY_DELAY)
+
+    def on_blacklist_notify(self, connection, pid, channel, payload):
+        """
+        Keeps the blacklist in sync with `blacklisted_users` across processes.
+        """
+        payload = json.loads(payload)
+        if payload["op"] == "DELETE":
+            self.blacklist.pop(payload["user_id"], None)
+        else:  # the reason doesn't fit in every payload, so it's fetched
+            self.bot.loop.create_task(self.fetch_blacklist_entry(payload["user_id"]))
+
+    async def fetch_blacklist_entry(self, user_id: int):
+        entry = await self.bot.pool.fetchrow("SELECT reason FROM blacklisted_users WHERE user_id = $1", user_id)
+        if entry is None:  # removed again in the meantime
+            self.blacklist.pop(user_id, None)
+        else:
+            self.blacklist[user_id] = entry["reason"]
 
     # async def dump_blacklist(self):
     #     pass
 
     async def add_blacklist(self, user_id: int, *, reason: str):
         await self.bot.pool.execute("INSERT INTO blacklisted_users VALUES ($1, $2)", user_id, reason)
-        self.blacklist.append(user_id)
+        self.blacklist[user_id] = reason
 
     async def remove_blacklist(self, user_id: int):
         await self.bot.pool.execute("DELETE FROM blacklisted_users WHERE user_id = $1", user_id)
-        self.blacklist.remove(user_id)
+        self.blacklist.pop(user_id, None)
 
     async def is_blacklisted(self, user_id: int):
         return user_id in self.blacklist
@@ -406,18 +847,32 @@ class Cache:
             self.todos[entry["user_id"]] = entry["tasks"]
 
     async def dump_todos(self):
-        items = deepcopy(self.todos).items()
-        for user_id, tasks_ in items:
-            await self.bot.pool.execute("UPDATE todos SET tasks = $1 WHERE user_id = $2", tasks_, user_id)
+        """
+        Writes the todo lists that changed since the last dump in a single batch.
+        """
+        async with self.todo_lock:
+            dirty, self.dirty_todos = self.dirty_todos, set()
+            data = [(user_id, list(self.todos[user_id])) for user_id in dirty if user_id in self.todos]
+            if not data:
+                return
+            try:
+                await self.bot.pool.executemany(
+                    "INSERT INTO todos (user_id, tasks) VALUES ($1, $2) "
+                    "ON CONFLICT (user_id) DO UPDATE SET tasks = EXCLUDED.tasks", data)
+            except Exception:
+                self.dirty_todos |= {user_id for user_id in dirty if user_id in self.todos}  # try again next dump
+                raise
 
     async def create_todo(self, user_id: int):
-        await self.bot.pool.execute("INSERT INTO todos VALUES ($1)", user_id)
         self.todos[user_id] = []
+        self.dirty_todos.add(user_id)
         return self.todos[user_id]
 
     async def delete_todo(self, user_id: int):
-        await self.bot.pool.execute("DELETE FROM todos WHERE user_id = $1", user_id)
-        self.todos.pop(user_id)
+        async with self.todo_lock:
+            await self.bot.pool.execute("DELETE FROM todos WHERE user_id = $1", user_id)
+            self.todos.pop(user_id, None)
+            self.dirty_todos.discard(user_id)
 
     async def get_todo(self, user_id: int):
         return self.todos.get(user_id, None)
@@ -428,22 +883,190 @@ class Cache:
             await self.delete_todo(user_id)
 
     async def add_todo(self, user_id: int, task: str):
-        await self.bot.pool.execute("UPDATE todos SET tasks = array_append(tasks, $1) WHERE user_id = $2", task, user_id)
         (await self.get_todo(user_id)).append(task)
+        self.dirty_todos.add(user_id)
 
     async def remove_todo(self, user_id: int, task: str):
-        await self.bot.pool.execute("UPDATE todos SET tasks = array_remove(tasks, $1) WHERE user_id = $2", task, user_id)
         (await self.get_todo(user_id)).remove(task)
+        self.dirty_todos.add(user_id)
 
         await self.cleanup_todo(user_id)
 
     async def clear_todos(self, user_id: int):
-        await self.bot.pool.execute("UPDATE todos SET tasks = '{}' WHERE user_id = $1", user_id)
         (await self.get_todo(user_id)).clear()
+        self.dirty_todos.add(user_id)
 
         await self.cleanup_todo(user_id)
 
 
+class HTTPClient:
+    """
+    Hands out one session per category of request, each with its own connection pool and timeout, so that a slow
+    third party host can't use up the connections needed for avatars and attachments. Records per-host latency and
+    error histograms.
+    """
+    def __init__(self):
+        overrides = config.get("http", {})
+        # overrides only replace the settings they give, missing ones fall back to the category's and then the default
+        self.categories = {category: {**HTTP_CATEGORIES["default"], **HTTP_CATEGORIES.get(category, {}),
+                                      **overrides.get(category, {})}
+                           for category in {**HTTP_CATEGORIES, **overrides}}
+        self.sessions = {}  # category: session, created on first use
+        self.latencies = OrderedDict()  # host: counts per bucket, least recently requested first
+        self.errors = defaultdict(Counter)  # host: status code or exception name: count
+
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_request_start.append(self.on_request_start)
+        self.trace_config.on_request_end.append(self.on_request_end)
+        self.trace_config.on_request_exception.append(self.on_request_exception)
+
+    def session(self, category: str = "default"):
+        if (session := self.sessions.get(category)) is None or session.closed:
+            settings = self.categories.get(category, self.categories["default"])
+            connector = aiohttp.TCPConnector(
+                limit=settings["limit"],
+                limit_per_host=settings["limit_per_host"],
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT)
+            session = self.sessions[category] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=settings["timeout"]),
+                trace_configs=[self.trace_config])
+        return session
+
+    async def close(self):
+        for session in self.sessions.values():
+            await session.close()
+        self.sessions.clear()
+
+    # tracing
+
+    async def on_request_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.start = time.perf_counter()
+
+    async def on_request_end(self, session, trace_config_ctx, params):
+        self.record(params.url.host, time.perf_counter() - trace_config_ctx.start)
+        if params.response.status >= 400:
+            self.errors[params.url.host][params.response.status] += 1
+
+    async def on_request_exception(self, session, trace_config_ctx, params):
+        self.record(params.url.host, time.perf_counter() - trace_config_ctx.start)
+        self.errors[params.url.host][type(params.exception).__name__] += 1
+
+    def record(self, host: str, elapsed: float):
+        if (counts := self.latencies.get(host)) is None:
+            counts = self.latencies[host] = [0] * (len(HTTP_LATENCY_BUCKETS) + 1)
+            if len(self.latencies) > HTTP_MAX_HOSTS:
+                evicted, _ = self.latencies.popitem(last=False)
+                self.errors.pop(evicted, None)
+        else:
+            self.latencies.move_to_end(host)
+        counts[bisect.bisect_left(HTTP_LATENCY_BUCKETS, elapsed)] += 1
+
+    # stats
+
+    @staticmethod
+    def percentile(counts: list, percentile: float):
+        """
+        Returns the upper bound of the bucket that the percentile falls in.
+        """
+        target = sum(counts) * percentile
+        total = 0
+        for bucket, count in enumerate(counts):
+            total += count
+            if total >= target:
+                return HTTP_LATENCY_BUCKETS[bucket] if bucket < len(HTTP_LATENCY_BUCKETS) else float("inf")
+        return 0.0
+
+    def histogram(self, host: str):
+        labels = [f"<{bound * 1000:g}ms" for bound in HTTP_LATENCY_BUCKETS] + [f">{HTTP_LATENCY_BUCKETS[-1]:g}s"]
+        return dict(zip(labels, self.latencies[host]))
+
+    def summary(self):
+        busiest = heapq.nlargest(HTTP_SUMMARY_HOSTS, self.latencies.items(), key=lambda item: sum(item[1]))
+        return {host: f"{sum(counts)} requests, p50 {self.percentile(counts, 0.5):g}s, "
+                      f"p95 {self.percentile(counts, 0.95):g}s, {sum(self.errors[host].values())} errors"
+                for host, counts in busiest}
+
+
+class HTTPCache:
+    """
+    Caches JSON responses from external APIs. Expired responses are revalidated with ETag/Last-Modified, concurrent
+    requests for the same url share one fetch and responses can optionally be shared between processes through redis.
+    """
+    def __init__(self, bot: PB_Bot):
+        self.bot = bot
+        self.entries = LRUCache(HTTP_CACHE_SIZE)  # key: {"status", "data", "etag", "last_modified", "expires"}
+        self.fetches = {}  # key: task
+        self.use_redis = config.get("http_cache_redis", False)
+        self.counters = Counter(hits=0, misses=0, revalidated=0, redis_hits=0)
+
+    @property
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {"size": len(self.entries), **self.counters,
+                "hit ratio": self.counters["hits"] / lookups if lookups else 0.0}
+
+    async def get_json(self, url: str, *, params: dict = None, ttl: float = HTTP_CACHE_TTL):
+        """
+        Returns the status and JSON body of a GET request, or `None` as the body if it isn't JSON.
+        """
+        key = f"{url}?{urlencode(sorted(params.items()))}" if params else url
+        entry = self.entries.get(key)
+        if entry is None and self.use_redis and self.bot.redis is not None:
+            if (raw := await self.bot.redis.get(f"http_cache:{key}", encoding="utf-8")) is not None:
+                entry = self.entries[key] = json.loads(raw)
+                self.counters["redis_hits"] += 1
+        if entry is not None and entry["expires"] > time.time():
+            self.counters["hits"] += 1
+            return entry["status"], entry["data"]
+
+        self.counters["misses"] += 1
+        if (fetch := self.fetches.get(key)) is None:
+            fetch = self.fetches[key] = self.bot.loop.create_task(self.fetch(key, url, params, ttl, entry))
+            fetch.add_done_callback(lambda _: self.fetches.pop(key, None))
+        return await asyncio.shield(fetch)
+
+    async def fetch(self, key: str, url: str, params: typing.Optional[dict], ttl: float, entry: typing.Optional[dict]):
+        headers = {}
+        if entry is not None:  # stale, ask the server whether it has changed
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        async with self.bot.http_client.session("api").get(url, params=params, headers=headers) as r:
+            if r.status == 304 and entry is not None:
+                self.counters["revalidated"] += 1
+                entry = {**entry, "expires": time.time() + ttl}
+            else:
+                try:
+                    data = await r.json(content_type=None)
+                except ValueError:
+                    data = None
+                entry = {"status": r.status, "data": data, "etag": r.headers.get("ETag"),
+                         "last_modified": r.headers.get("Last-Modified"), "expires": time.time() + ttl}
+
+        if entry["status"] >= 500:  # don't cache server errors
+            return entry["status"], entry["data"]
+        stale_ttl = HTTP_CACHE_STALE_TTL
+        if not 200 <= entry["status"] < 300:  # other responses are only cached briefly and never revalidated
+            ttl, stale_ttl = min(ttl, HTTP_CACHE_ERROR_TTL), 0
+            entry["expires"] = time.time() + ttl
+        self.entries[key] = entry
+        if self.use_redis and self.bot.redis is not None:
+            await self.bot.redis.set(f"http_cache:{key}", json.dumps(entry), expire=max(int(ttl + stale_ttl), 1))
+        return entry["status"], entry["data"]
+
+
+class LazyCog(commands.Cog):
+    """
+    A placeholder for a cog that hasn't been loaded yet, holding stub commands built from its source. It has none of
+    the real cog's checks.
+    """
+    extension: str
+
+
 class CustomContext(commands.Context):
     """
     Custom context class.
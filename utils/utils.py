@@ -5,15 +5,24 @@ from discord.ext import commands
 import datetime
 import time
 import random
-from collections import deque
+from collections import deque, OrderedDict
 import asyncio
 import dateparser
 import humanize
 import typing
 import textwrap
+import ast
 
 from contextlib import suppress
-from aiohttp import InvalidURL
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from aiohttp import InvalidURL, ClientError
+
+
+# constants
+
+MISSING = object()
+TURKISH_IS = {"İ": "i", "ı": "i"}  # the regex engine treats these as i when ignoring case, casefold doesn't
 
 
 # helper functions
@@ -43,6 +52,86 @@ def humanize_list(li: list):
     return f"{', '.join(str(item) for item in li[:-1])} and {li[-1]}"
 
 
+def get_imported_modules(tree: ast.Module):
+    """
+    Gets the names of the modules imported at the top level of a parsed module, in import order.
+    """
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def get_signature(func: ast.AsyncFunctionDef, source: str):
+    """
+    Builds a command's signature from its parsed callback, the same way `Command.signature` does.
+    """
+    args = func.args
+    positional = args.posonlyargs + args.args
+    defaults = [MISSING] * (len(positional) - len(args.defaults)) + args.defaults
+    params = list(zip(positional, defaults))[2:]  # self and ctx
+    if args.vararg:
+        params.append((args.vararg, MISSING))
+    params.extend(zip(args.kwonlyargs, (MISSING if default is None else default for default in args.kw_defaults)))
+
+    result = []
+    for arg, default in params:
+        if arg is args.vararg:
+            result.append(f"[{arg.arg}...]")
+        elif default is not MISSING:
+            try:
+                value = ast.literal_eval(default)
+            except ValueError:
+                value = ast.get_source_segment(source, default)
+            should_print = value if isinstance(value, str) else value is not None
+            result.append(f"[{arg.arg}={value}]" if should_print else f"[{arg.arg}]")
+        elif isinstance(arg.annotation, ast.Subscript) and "Optional" in ast.get_source_segment(source,
+                                                                                                arg.annotation.value):
+            result.append(f"[{arg.arg}]")
+        else:
+            result.append(f"<{arg.arg}>")
+    return " ".join(result)
+
+
+def get_cog_info(source: str):
+    """
+    Gets the names, descriptions and commands of the cogs defined in a module's source, without importing it.
+    Each command is a dict of the attributes help needs, the lines it spans and its subcommands (None if it isn't
+    a group).
+    """
+    cogs = []
+    for cls in (node for node in ast.parse(source).body if isinstance(node, ast.ClassDef)):
+        groups = {}  # function name: command, so that subcommands can find their group
+        cog_commands = []
+        for func in (node for node in cls.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))):
+            for decorator in func.decorator_list:
+                if not (isinstance(decorator, ast.Call) and isinstance(decorator.func, ast.Attribute)
+                        and isinstance(decorator.func.value, ast.Name) and decorator.func.attr in ("command", "group")):
+                    continue
+                parent = decorator.func.value.id
+                if parent != "commands" and parent not in groups:
+                    continue
+                kwargs = {keyword.arg: keyword.value for keyword in decorator.keywords}
+                command = {
+                    "name": ast.literal_eval(kwargs["name"]) if "name" in kwargs else func.name,
+                    "aliases": ast.literal_eval(kwargs["aliases"]) if "aliases" in kwargs else [],
+                    "help": ast.get_docstring(func),
+                    "usage": ast.literal_eval(kwargs["usage"]) if "usage" in kwargs else get_signature(func, source),
+                    "hidden": ast.literal_eval(kwargs["hidden"]) if "hidden" in kwargs else False,
+                    "lines": (min(node.lineno for node in func.decorator_list), func.end_lineno),
+                    "commands": [] if decorator.func.attr == "group" else None,
+                }
+                if command["commands"] is not None:
+                    groups[func.name] = command
+                (cog_commands if parent == "commands" else groups[parent]["commands"]).append(command)
+        if cog_commands:
+            cogs.append({"name": cls.name, "description": ast.get_docstring(cls) or "", "commands": cog_commands})
+    return cogs
+
+
 class StopWatch:
     __slots__ = ("start_time", "end_time")
 
@@ -68,6 +157,158 @@ class StopWatch:
         return self.end_time - self.start_time
 
 
+class PrefixMatcher:
+    """
+    Matches a set of prefixes against message content with a single precompiled pattern.
+    Shorter prefixes are tried first and prefixes are matched case-insensitively.
+    """
+    __slots__ = ("prefixes", "first_chars", "pattern")
+
+    def __init__(self, prefixes: typing.Iterable[str]):
+        self.prefixes = tuple(sorted(prefixes, key=len))
+        self.first_chars = frozenset(self.fold(prefix) for prefix in self.prefixes if prefix)
+        alternatives = "|".join(re.escape(prefix) for prefix in self.prefixes)
+        self.pattern = re.compile(rf"(?:{alternatives})\s*", flags=re.IGNORECASE)
+
+    def match(self, content: str):
+        """
+        Returns the matched prefix (including any trailing whitespace) or `None`.
+        """
+        if match := self.pattern.match(content):
+            return match.group(0)
+
+    @staticmethod
+    def fold(text: str):
+        """
+        Casefolds the first character the same way the case-insensitive pattern compares it.
+        """
+        return TURKISH_IS.get(text[:1], text[:1].casefold())
+
+    def could_match(self, content: str):
+        """
+        Cheap check on the first character only. `False` means that no prefix can match.
+        """
+        return self.fold(content) in self.first_chars
+
+
+class LRUCache:
+    """
+    A mapping bounded to `maxsize` entries that evicts the least recently used entry first.
+    Entries expire after `ttl` seconds if a ttl is given. If `maxbytes` is given, values must be bytes and the total
+    size of the values is bounded as well. `on_evict` is called with the key and value of every entry that is evicted
+    or expires.
+    """
+    def __init__(self, maxsize: int = None, *, ttl: float = None, maxbytes: int = None,
+                 on_evict: typing.Callable = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key: (expires_at, value)
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.peek(key, MISSING) is not MISSING
+
+    def __setitem__(self, key, value):
+        if self.maxbytes is not None and len(value) > self.maxbytes:
+            return
+        self.pop(key)
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (expires_at, value)
+        if self.maxbytes is not None:
+            self.nbytes += len(value)
+        while ((self.maxsize is not None and len(self._data) > self.maxsize)
+               or (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            self._evict(*self._data.popitem(last=False))
+
+    def _evict(self, key, item):
+        if self.maxbytes is not None:
+            self.nbytes -= len(item[1])
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, item[1])
+
+    def peek(self, key, default=None):
+        """
+        Gets an entry without updating its recency or the hit and miss counters.
+        """
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            return default
+        if expires_at is not None and expires_at < time.monotonic():
+            self._evict(key, self._data.pop(key))
+            return default
+        return value
+
+    def get(self, key, default=None):
+        value = self.peek(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def pop(self, key, default=None):
+        try:
+            value = self._data.pop(key)[1]
+        except KeyError:
+            return default
+        if self.maxbytes is not None:
+            self.nbytes -= len(value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.nbytes = 0
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {"size": len(self._data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                 "hit ratio": self.hits / lookups if lookups else 0.0}
+        if self.maxbytes is not None:
+            stats["bytes"] = self.nbytes
+        return stats
+
+
+class ProcessPool:
+    """
+    A process pool that replaces itself when one of its workers dies (e.g. killed for using too much memory), which
+    would otherwise break the pool for good. Jobs that were lost with the broken pool are retried once.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, **kwargs):
+        self.loop = loop
+        self.kwargs = kwargs  # passed to every ProcessPoolExecutor
+        self.executor = ProcessPoolExecutor(**kwargs)
+        self.restarts = 0
+
+    async def run(self, func: typing.Callable, *args):
+        for attempt in range(2):
+            executor = self.executor
+            try:
+                return await self.loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                if self.executor is executor:  # the other jobs that were lost with it don't replace it again
+                    self.executor = ProcessPoolExecutor(**self.kwargs)
+                    self.restarts += 1
+                    executor.shutdown(wait=False)
+                if attempt:
+                    raise
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
 # page sources
 
 
@@ -572,74 +813,117 @@ class StripCodeblocks(commands.Converter):
 
 
 class ImageConverter(commands.Converter):
+    """
+    Converts an argument to image bytes. The argument is classified once and every download goes through a shared
+    cache, with at most one download in flight per url.
+    """
+    max_bytes = 8 * 1024 * 1024
+    cache = LRUCache(256, ttl=5 * 60, maxbytes=64 * 1024 * 1024)  # url: bytes
+    fetches = {}  # url: task
+
     def __init__(self, bot):
         self.bot = bot
 
     image_regex = re.compile(r"image/.+", flags=re.IGNORECASE)
+    url_regex = re.compile(r"<?(https?://\S+?)>?", flags=re.IGNORECASE)
+    custom_emoji_regex = re.compile(r"<(a?):\w+:(\d+)>")
 
-    async def _convert(self, message: discord.Message, argument: str):
+    async def fetch(self, url: str):
+        if (image := ImageConverter.cache.get(url)) is not None:
+            return image
+        if (fetch := ImageConverter.fetches.get(url)) is None:
+            fetch = ImageConverter.fetches[url] = self.bot.loop.create_task(self._fetch(url))
+            fetch.add_done_callback(lambda _: ImageConverter.fetches.pop(url, None))
+        return await asyncio.shield(fetch)
+
+    async def _fetch(self, url: str):
+        too_large = commands.BadArgument(f"That image is too large (>{humanize.naturalsize(self.max_bytes)}).")
+        try:
+            async with self.bot.http_client.session("images").get(url) as r:
+                if r.status not in range(200, 300) or not ImageConverter.image_regex.fullmatch(
+                        r.headers.get("Content-Type", "")):
+                    return None
+                if r.content_length is not None and r.content_length > self.max_bytes:
+                    raise too_large
+                image = bytearray()
+                async for chunk in r.content.iter_chunked(64 * 1024):  # stop as soon as the limit is passed
+                    image += chunk
+                    if len(image) > self.max_bytes:
+                        raise too_large
+        except (InvalidURL, ClientError, asyncio.TimeoutError):
+            return None
+        image = bytes(image)
+        ImageConverter.cache[url] = image
+        return image
+
+    async def _convert(self, ctx: commands.Context, message: discord.Message, argument: str):
         # hierarchy:
+        # custom emojis
+        # links
         # members
         # users
-        # emojis
         # unicode emojis
-        # links
         # attachments
 
-        ctx = await self.bot.get_context(message)
-
         if argument:  # no need to check if x is in the message if x is nothing
-            # members
-            with suppress(commands.BadArgument):
-                return await (await commands.MemberConverter().convert(ctx, argument)).avatar_url_as(format="png").read()
+            if message != ctx.message:  # converters need a context for the message the argument came from
+                ctx = await self.bot.get_context(message)
 
-            # users
-            with suppress(commands.BadArgument):
-                return await (await commands.UserConverter().convert(ctx, argument)).avatar_url_as(format="png").read()
+            # custom emojis and embedded images (links) fall through to the attachments if they aren't images
+            if match := ImageConverter.custom_emoji_regex.fullmatch(argument):
+                extension = "gif" if match.group(1) else "png"
+                if image := await self.fetch(f"https://cdn.discordapp.com/emojis/{match.group(2)}.{extension}"):
+                    return image
 
-            # emojis
-            with suppress(commands.BadArgument):
-                return await (await commands.PartialEmojiConverter().convert(ctx, argument)).url.read()
+            elif match := ImageConverter.url_regex.fullmatch(argument):
+                if image := await self.fetch(match.group(1)):
+                    return image
+
+            else:
+                # members
+                with suppress(commands.BadArgument):
+                    member = await commands.MemberConverter().convert(ctx, argument)
+                    return await self.fetch(str(member.avatar_url_as(format="png")))
 
-            # unicode emojis
-            url = f"https://twemoji.maxcdn.com/v/latest/72x72/{ord(argument[0]):x}.png"
-            async with self.bot.session.get(url) as r:
-                if r.status in range(200, 300):
-                    return await r.read()
+                # users
+                with suppress(commands.BadArgument):
+                    user = await commands.UserConverter().convert(ctx, argument)
+                    return await self.fetch(str(user.avatar_url_as(format="png")))
 
-            # embedded images (links)
-            with suppress(InvalidURL):
-                async with self.bot.session.get(argument) as r:
-                    if r.status in range(200, 300) and ImageConverter.image_regex.fullmatch(r.headers["Content-Type"]):
-                        return await r.read()
+                # unicode emojis
+                if not argument[0].isascii():
+                    return await self.fetch(f"https://twemoji.maxcdn.com/v/latest/72x72/{ord(argument[0]):x}.png")
 
         # attachments
         if message.attachments:
             for attachment in message.attachments:
                 if attachment.height or attachment.width:  # is an image
-                    return await attachment.read()
+                    if attachment.size > self.max_bytes:
+                        raise commands.BadArgument(
+                            f"That image is too large (>{humanize.naturalsize(self.max_bytes)}).")
+                    return await self.fetch(attachment.url)
 
         return
 
     async def convert(self, ctx: commands.Context, argument: str):
         # invocation message
-        if image := await self._convert(ctx.message, argument):
+        if image := await self._convert(ctx, ctx.message, argument):
             return image
 
         # message link
         if argument:
             with suppress(commands.BadArgument):
                 message = await commands.MessageConverter().convert(ctx, argument)
-                if image := await self._convert(message, message.content):
+                if image := await self._convert(ctx, message, message.content):
                     return image
 
         # referenced message (reply)
         if ctx.message.reference and isinstance(ctx.message.reference.resolved, discord.Message):
-            if image := await self._convert(ctx.message.reference.resolved, ctx.message.reference.resolved.content):
+            if image := await self._convert(ctx, ctx.message.reference.resolved, ctx.message.reference.resolved.content):
                 return image
 
         # fallback
-        return await ctx.author.avatar_url_as(format="png").read()
+        return await self.fetch(str(ctx.author.avatar_url_as(format="png")))
 
 
 # game classes